@@ -20,6 +20,21 @@ Options:
   --library -l SRC     Generates only the dynamic part of the parser and
                        includes the static parts using `source SRC`.
                        Use `generate-library` to create that file.
+  --codegen -c MODE    Generate functions that call generic helpers for every
+                       node of the usage (`helpers`), specialized functions
+                       with the helpers inlined (`inline`) or `helpers`
+                       functions that are defined once their usage line is
+                       tried (`lazy`). `auto` matches usages without
+                       backtracking where possible and uses `helpers`
+                       otherwise (default: auto)
+  --fold-settings -F   Specialize the parser for the $DOCOPT_* parameters that
+                       the script assigns a literal before invoking docopt,
+                       has no effect with --library
+  --define-once -D     Only define the functions of the parser the first time
+                       docopt_parse is called, for parsing in loops
+  --target -t SHELL    Generate a parser for `bash` or for POSIX sh (`posix`),
+                       e.g. dash. The latter only supports the `helpers`
+                       codegen and `eval "$(docopt "$@")"` (default: bash)
   --no-auto-params -P  Disable auto-detection parser generation parameters
   --parser -p          Output the parser instead of inserting it in the script
   --help -h            Show this help screen
@@ -48,7 +63,7 @@ def docopt_sh(params):
   # which matches it first. We want it in that order though, but there's a simple workaround:
   if params['SCRIPT'] == 'generate-library':
     library = Library()
-    exclude = ['docopt']
+    exclude = ['docopt', 'docopt_parse']
     sys.stdout.write('#!/usr/bin/env bash\n\n' + str(library.generate_code(exclude=exclude)))
   else:
     try:
@@ -1,6 +1,7 @@
 import re
 from shlex import quote
-from itertools import chain
+from itertools import chain, product
+from string import ascii_lowercase
 
 
 class Code(object):
@@ -14,8 +15,8 @@ class Code(object):
     else:
       return iter(code)
 
-  def minify(self, max_line_length):
-    return Code(minify(str(self), max_line_length))
+  def minify(self, max_line_length, reserved=None, namespace=''):
+    return Code(minify(str(self), max_line_length, reserved, namespace))
 
   def replace_literal(self, replacements):
     def gen_replace():
@@ -76,57 +77,332 @@ def bash_ifs_value(value):
   raise Exception('Unhandled value type %s' % type(value))
 
 
-def minify(parser_str, max_length):
-  lines = parser_str.split('\n')
-  lines = remove_leading_spaces(lines)
-  lines = remove_empty_lines(lines)
-  lines = remove_comments(lines)
-  lines = remove_newlines(lines, max_length)
-  return '\n'.join(lines) + '\n'
+checksum_escapes = [
+  (b'@', b'@@'), (b'-', b'@a'), (b'[', b'@b'), (b']', b'@c'), (b'(', b'@d'),
+  (b')', b'@e'), (b'|', b'@f'), (b'<', b'@g'), (b'>', b'@h'), (b'.', b'@i'),
+  (b'=', b'@j'), (b',', b'@k'), (b':', b'@l'), (b'\n', b' @n '),
+]
+base64_digits = b'0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ@_'
+
+
+def doc_checksum(doc):
+  # Mirrors checksum() in docopt.sh, which only uses bash builtins
+  value = doc.encode('utf-8')
+  for char, escape in checksum_escapes:
+    value = value.replace(char, escape)
+  words = re.sub(rb'[^0-9a-zA-Z@_ \t]', b'_', value).split()
+  checksum = len(doc.encode('utf-8'))
+  tails = [word[10:] if len(word) >= 10 else word for word in words]
+  for chunk in [word[:10] for word in words + tails] or [b'']:
+    number = 0
+    for digit in chunk:
+      number = number * 64 + base64_digits.index(digit)
+    checksum = (checksum * 65599 + number) & 0xffffffff
+  return 'wsum:%08x' % checksum
+
+
+identifier_re = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# characters after which a word starts in code
+word_boundaries = ' \t\n;|&(){}!'
+keywords = ['if', 'then', 'else', 'elif', 'fi', 'case', 'esac', 'for', 'select', 'while', 'until', 'do', 'done',
+            'in', 'function', 'time', 'coproc']
+
+
+class Lexer(object):
+  """Splits bash code into (kind, text) tokens.
+
+  "word" tokens are the identifiers that refer to a variable or a function,
+  i.e. the ones at the start of a word, in expansions and in arithmetic.
+  "space", "newline", "continuation", "comment" and "operator" (;, &&, || and |)
+  tokens only occur outside of quotes and expansions. Everything else is
+  "text", which includes identifiers that are merely part of a string or an
+  option like --help. Only the constructs used by the parser are recognized.
+  """
 
-
-def remove_leading_spaces(lines):
-  for line in lines:
-    yield re.sub(r'^\s*', '', line)
-
-
-def remove_empty_lines(lines):
-  for line in lines:
-    if line != '':
-      yield line
-
-
-def remove_comments(lines):
-  for line in lines:
-    if re.match(r'^\s*#', line) is None:
-      yield line
-
-
-def remove_newlines(lines, max_length):
-  def needs_separator(line):
-    return re.search(r'; (then|do)$|else$|\{$', line) is None
-
-  def has_continuation(line):
-    return re.search(r'\\\s*$', line) is not None
-
-  def remove_continuation(line):
-    return re.sub(r'\s*\\\s*$', '', line)
-
-  def combine(line1, line2):
-    if has_continuation(line1):
-      return remove_continuation(line1) + ' ' + line2
-    if needs_separator(line1):
-      return line1 + '; ' + line2
+  def __init__(self, code):
+    self.code = code
+    self.pos = 0
+    self.tokens = []
+    self.scan_code(None)
+
+  def emit(self, kind, text):
+    if kind == 'text' and self.tokens and self.tokens[-1][0] == 'text':
+      self.tokens[-1] = ('text', self.tokens[-1][1] + text)
     else:
-      return line1 + ' ' + line2
-
-  previous = next(lines)
+      self.tokens.append((kind, text))
+    self.pos += len(text)
+
+  def peek(self, text):
+    return self.code.startswith(text, self.pos)
+
+  def previous(self):
+    return self.code[self.pos - 1] if self.pos > 0 else '\n'
+
+  def identifier(self):
+    match = identifier_re.match(self.code, self.pos)
+    return match.group(0) if match else None
+
+  def scan_code(self, end):
+    # end is the ")" of a command substitution, None at the top level
+    top = end is None
+    depth = 0
+    while self.pos < len(self.code):
+      char = self.code[self.pos]
+      name = self.identifier()
+      if not top and char == ')' and depth == 0:
+        return
+      elif char in ' \t':
+        self.emit('space' if top else 'text', re.match(r'[ \t]+', self.code[self.pos:]).group(0))
+      elif char == '\n':
+        self.emit('newline' if top else 'text', char)
+      elif self.peek('\\\n'):
+        self.emit('continuation' if top else 'text', '\\\n')
+      elif char == '\\':
+        self.emit('text', self.code[self.pos:self.pos + 2])
+      elif char == '#' and self.previous() in word_boundaries:
+        self.emit('comment', re.match(r'[^\n]*', self.code[self.pos:]).group(0))
+      elif char in ';|&' and top and self.previous() not in '<>':
+        self.emit('operator', re.match(r'[;|&]+', self.code[self.pos:]).group(0))
+      elif self.peek("$'"):
+        self.scan_ansi_c()
+      elif char == "'":
+        self.scan_single()
+      elif char == '"':
+        self.scan_double()
+      elif char == '$':
+        self.scan_dollar()
+      elif self.peek('((') and self.previous() in word_boundaries:
+        self.emit('text', '((')
+        self.scan_arithmetic('))')
+        self.emit('text', '))')
+      elif name is not None and self.previous() in word_boundaries and \
+              self.code[self.pos + len(name):self.pos + len(name) + 1] not in [')', '|']:
+        # names followed by ) or | are case patterns
+        self.emit('word', name)
+        if self.peek('['):
+          self.scan_subscript()
+      elif name is not None:
+        self.emit('text', name)
+      else:
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        self.emit('text', char)
+
+  def scan_single(self):
+    self.emit('text', self.code[self.pos:self.code.index("'", self.pos + 1) + 1])
+
+  def scan_ansi_c(self):
+    self.emit('text', re.match(r"\$'(\\.|[^\\'])*'", self.code[self.pos:], re.DOTALL).group(0))
+
+  def scan_double(self):
+    self.emit('text', '"')
+    while not self.peek('"'):
+      name = self.identifier()
+      if self.peek('\\$'):
+        # escaped for a later eval, which expands it instead
+        self.emit('text', '\\')
+        self.scan_dollar()
+      elif self.peek('\\'):
+        self.emit('text', self.code[self.pos:self.pos + 2])
+      elif self.peek('$'):
+        self.scan_dollar()
+      elif name is not None:
+        # the prefix of a dynamically named node function
+        self.emit('word' if name.startswith('docopt__node_') and self.previous() == '"' else 'text', name)
+      else:
+        self.emit('text', self.code[self.pos])
+    self.emit('text', '"')
+
+  def scan_dollar(self):
+    name = identifier_re.match(self.code, self.pos + 1)
+    if self.peek('${'):
+      self.emit('text', '${')
+      self.scan_parameter()
+      self.emit('text', '}')
+    elif self.peek('$(('):
+      self.emit('text', '$((')
+      self.scan_arithmetic('))')
+      self.emit('text', '))')
+    elif self.peek('$('):
+      self.emit('text', '$(')
+      self.scan_code(')')
+      self.emit('text', ')')
+    elif name is not None:
+      self.emit('text', '$')
+      self.emit('word', name.group(0))
+    else:
+      self.emit('text', '$')
+
+  def scan_parameter(self):
+    # ${#name[subscript]...}, identifiers after the name are only variables in offsets
+    if re.match(r'[#!][^}]', self.code[self.pos:self.pos + 2]):
+      self.emit('text', self.code[self.pos])
+    name = self.identifier()
+    if name is not None:
+      self.emit('word', name)
+      if self.peek('['):
+        self.scan_subscript()
+    while not self.peek('}'):
+      name = self.identifier()
+      if self.peek('\\'):
+        self.emit('text', self.code[self.pos:self.pos + 2])
+      elif self.peek("$'"):
+        self.scan_ansi_c()
+      elif self.peek("'"):
+        self.scan_single()
+      elif self.peek('"'):
+        self.scan_double()
+      elif self.peek('$'):
+        self.scan_dollar()
+      elif name is not None:
+        self.emit('word' if self.previous() in ':*+' else 'text', name)
+      else:
+        self.emit('text', self.code[self.pos])
+
+  def scan_subscript(self):
+    self.emit('text', '[')
+    self.scan_arithmetic(']')
+    self.emit('text', ']')
+
+  def scan_arithmetic(self, end):
+    depth = 0
+    while depth > 0 or not self.peek(end):
+      char = self.code[self.pos]
+      name = self.identifier()
+      if self.peek('"'):
+        self.scan_double()
+      elif self.peek('$'):
+        self.scan_dollar()
+      elif char.isdigit():
+        self.emit('text', re.match(r'[0-9][A-Za-z0-9_#]*', self.code[self.pos:]).group(0))
+      elif name is not None:
+        self.emit('word', name)
+      else:
+        depth += {'(': 1, '[': 1, ')': -1, ']': -1}.get(char, 0)
+        self.emit('text', char)
+
+
+def tokenize(code):
+  return Lexer(code).tokens
+
+
+def mangle(tokens, reserved, namespace=''):
+  # Renames the functions and local variables to the shortest names that are not
+  # in use, the more often a name is referenced the shorter its new name. Names that
+  # also occur as plain text (e.g. in a message or an eval'd string) are kept, as are
+  # the docopt* names outside of the docopt__ namespace of the parser functions, the
+  # uppercase names, the var_* variables that the output is read from and the reserved
+  # ones. docopt__node_* is a prefix, node functions are called by dynamically built
+  # names. The new function names start with the namespace when there is one
+  functions = set()
+  variables = set()
+  in_local = False
+  for idx, (kind, text) in enumerate(tokens):
+    following = tokens[idx + 1] if idx + 1 < len(tokens) else ('', '')
+    if kind == 'word' and following[0] == 'text' and following[1].startswith('()'):
+      functions.add(text)
+    if kind in ['newline', 'operator']:
+      in_local = False
+    elif kind == 'word' and text == 'local' and (idx == 0 or tokens[idx - 1][0] != 'text'):
+      in_local = True
+    elif kind == 'word' and in_local and tokens[idx - 1][0] == 'space':
+      variables.add(text)
+  used = set([text for kind, text in tokens if kind == 'word'])
+  literal = set(reserved)
+  for kind, text in tokens:
+    if kind == 'text':
+      literal.update(identifier_re.findall(text))
+
+  def mangleable(name):
+    return name not in literal and name.upper() != name and \
+      (name.startswith('docopt__') or not name.lower().startswith('docopt')) and \
+      not name.startswith(('DOC', 'var_', 'docopt__node_'))
+  counts = {}
+  for kind, text in tokens:
+    if kind == 'word' and text in (functions | variables) and mangleable(text):
+      counts[text] = counts.get(text, 0) + 1
+  taken = (used | literal) - set(counts.keys())
+
+  def names():
+    for length in range(1, 4):
+      for letters in product(ascii_lowercase, repeat=length):
+        yield ''.join(letters)
+  mapping = {}
+  # function names are prefixed, they would shadow commands of the same name
+  function_prefix = namespace or '_'
+  candidates = {'': names(), function_prefix: names()}
+  for name in sorted(counts.keys(), key=lambda name: (-counts[name], name)):
+    kind = function_prefix if name in functions else ''
+    new_name = kind + next(candidates[kind])
+    while new_name in keywords or new_name in taken:
+      new_name = kind + next(candidates[kind])
+    mapping[name] = new_name
+  taken |= set(mapping.values())
+  prefix = 'docopt__node_'
+  if not any(name.startswith('docopt__node_') for name in literal):
+    prefix = next((namespace + prefix for prefix in ['n', 'N', '_n', '_N'] if not any(
+      name.startswith(namespace + prefix) for name in taken if not name.startswith('docopt__node_'))), prefix)
+
+  def rename(text):
+    if text.startswith('docopt__node_'):
+      return prefix + text[len('docopt__node_'):]
+    return mapping.get(text, text)
+  return [(kind, rename(text) if kind == 'word' else text) for kind, text in tokens]
+
+
+def minify(parser_str, max_length, reserved=None, namespace=''):
+  # Removes comments & indentation and joins the lines up to max_length, pass the names
+  # that must not change in reserved to also shorten the names of functions and variables
+  code = '\n'.join([line.lstrip(' \t') for line in parser_str.split('\n')])
+  tokens = tokenize(code)
+  if reserved is not None:
+    tokens = mangle(tokens, reserved, namespace)
+  lines = []
+  line = ''
+  for idx, (kind, text) in enumerate(tokens):
+    following = tokens[idx + 1] if idx + 1 < len(tokens) else ('newline', '\n')
+    if kind == 'newline':
+      if line != '':
+        lines.append(line)
+      line = ''
+    elif kind == 'continuation':
+      # the line is continued when it is joined with the next one, see join_lines()
+      lines.append(line.rstrip(' ') + ' \\')
+      line = ''
+    elif kind == 'space':
+      # spaces around operators are not needed, neither is the one in `name() {`
+      if line != '' and not line.endswith(' ') and tokens[idx - 1][0] != 'operator' and \
+         following[0] not in ['operator', 'newline', 'comment', 'continuation'] and \
+         not (line.endswith('()') and following[1].startswith('{')):
+        line += ' '
+    elif kind != 'comment':
+      line += text
+  if line != '':
+    lines.append(line)
+  return '\n'.join(join_lines(lines, max_length)) + '\n'
+
+
+def join_lines(lines, max_length):
+  def separator(line):
+    # keywords like `then` must be followed by a command on the same line, the
+    # others are terminated by a newline, which is replaced by a semicolon
+    if re.search(r'(^|[\s;])(then|do|else|in)$|\{$', line):
+      return ' '
+    if re.search(r'(;|&&|\|\||\|)$', line):
+      return ''
+    return ';'
+
+  previous = None
   for line in lines:
-    combined = combine(previous, line)
-    if len(combined) > max_length:
-      yield previous
+    if previous is None:
       previous = line
+      continue
+    # a continued line is joined without its backslash, lines that contain a
+    # string with newlines are only measured where they are joined
+    head = previous[:-1] if previous.endswith(' \\') else previous + separator(previous)
+    if len(head.split('\n')[-1] + line.split('\n')[0]) <= max_length:
+      previous = head + line
     else:
-      previous = combined
-  if previous:
+      yield previous
+      previous = line
+  if previous is not None:
     yield previous
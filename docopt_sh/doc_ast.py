@@ -16,13 +16,241 @@ class DocAst(object):
     # Enumerate leaf nodes first so that their function index & index in the params array match
     for idx, param in enumerate(sorted_params):
       node_map[param] = LeafNode(param, idx)
-    offset = len(node_map)
-    for idx, pattern in enumerate(iter(root)):
-      if isinstance(pattern, BranchPattern):
-        node_map[pattern] = BranchNode(pattern, offset + idx, node_map)
+    occurrences, below_either = count_branches(root)
+    # Branches that occur more than once share a node, the ones among them that are
+    # below an Either may be matched against the same tokens repeatedly
+    self.shared = set(p for p, count in occurrences.items() if count > 1)
+    memoized = self.shared & below_either
+    for pattern in iter(root):
+      # Equal branches share a node, parents of later occurrences refer to the first one
+      if isinstance(pattern, BranchPattern) and pattern not in node_map:
+        node_map[pattern] = BranchNode(pattern, len(node_map), node_map, memoize=pattern in memoized)
 
     self.root_node = node_map[root]
+    self.node_map = node_map
     self.nodes = node_map.values()
+    self.automaton = Automaton.compile(root)
+
+  @property
+  def features(self):
+    """The grammar features that the usage uses, the parser leaves out the code paths of the others."""
+    from .node import LeafNode
+    features = set()
+    for node in self.nodes:
+      if type(node) is not LeafNode:
+        continue
+      if type(node.pattern) is Option:
+        if node.pattern.short is not None:
+          features.add('short options')
+        if node.pattern.long is not None:
+          features.add('long options')
+        feature = 'flags' if node.helper_name == 'docopt__switch' else 'option values'
+      elif type(node.pattern) is Command:
+        feature = 'commands'
+      else:
+        feature = 'arguments'
+      features.add(('repeated ' if node.repeating else '') + feature)
+    return features
+
+
+def count_branches(root):
+  """Count how often each branch occurs in the tree and find the ones below an Either."""
+  occurrences = {}
+  below_either = set()
+
+  def walk(pattern, in_either):
+    for child in pattern.children:
+      if isinstance(child, BranchPattern):
+        occurrences[child] = occurrences.get(child, 0) + 1
+        if in_either:
+          below_either.add(child)
+        walk(child, in_either or type(pattern) is Either)
+  walk(root, False)
+  return occurrences, below_either
+
+
+class Irregular(Exception):
+  """The usage can only be matched by backtracking."""
+
+
+class Alternative(object):
+  """A usage alternative that can be matched without backtracking.
+
+  Positionals are matched greedily in order, options are matched
+  regardless of their position and may only occur once per alternative.
+  """
+
+  def __init__(self, pattern):
+    # (leafs, optional, repeating) of every positional item in order
+    self.positionals = []
+    # (min, max) occurrences per option, max is None when unlimited
+    self.options = OrderedDict([])
+    # (options, required) for Eithers of options, of which only one may be specified
+    self.groups = []
+    self.add(pattern, False)
+
+  def add(self, pattern, optional):
+    if type(pattern) is Option:
+      self.add_option(pattern, 0 if optional else 1, 1)
+    elif type(pattern) in [Argument, Command]:
+      self.positionals.append(([pattern], optional, False))
+    elif type(pattern) in [Optional, OptionsShortcut]:
+      for child in pattern.children:
+        self.add(child, True)
+    elif type(pattern) is Required:
+      if optional and len(pattern.children) > 1:
+        raise Irregular('required group inside of an optional one')
+      for child in pattern.children:
+        self.add(child, optional)
+    elif type(pattern) is OneOrMore:
+      if len(pattern.children) != 1:
+        raise Irregular('repetition of a group')
+      child = pattern.children[0]
+      if type(child) is Option:
+        self.add_option(child, 0 if optional else 1, None)
+      else:
+        self.positionals.append((positional_leafs(child), optional, True))
+    elif type(pattern) is Either:
+      if all(type(child) is Option for child in pattern.children):
+        for child in pattern.children:
+          self.add_option(child, 0, None)
+        self.groups.append((pattern.children, not optional))
+      else:
+        self.positionals.append((positional_leafs(pattern), optional, False))
+    else:
+      raise Irregular('unknown pattern %r' % pattern)
+
+  def add_option(self, option, min, max):
+    if option in self.options:
+      raise Irregular('%s specified more than once' % option.name)
+    self.options[option] = (min, max)
+
+  def step(self, state, name):
+    # Returns the state after the positional `name` (None if it is not a command)
+    # and the leaf that matched it, or None when the alternative does not match
+    idx, matched = state
+    while idx < len(self.positionals):
+      leafs, optional, repeating = self.positionals[idx]
+      for leaf in leafs:
+        if type(leaf) is Argument or leaf.name == name:
+          return ((idx, True) if repeating else (idx + 1, False)), leaf
+      if not (optional or repeating and matched):
+        return None
+      idx, matched = idx + 1, False
+    return None
+
+  def accepts(self, state):
+    idx, matched = state
+    remaining = self.positionals[idx:]
+    return all(optional or repeating and matched and i == 0
+               for i, (_, optional, repeating) in enumerate(remaining))
+
+
+def positional_leafs(pattern):
+  if type(pattern) in [Argument, Command]:
+    return [pattern]
+  if type(pattern) is Either and all(type(child) in [Argument, Command] for child in pattern.children):
+    return pattern.children
+  raise Irregular('unknown positional pattern %r' % pattern)
+
+
+class Automaton(object):
+  """Deterministic automaton over the positionals of all usage alternatives.
+
+  A state is the tuple of the states of the alternatives (None once an
+  alternative failed), the positionals are classified by the command they
+  name (class 0 is any other value). Options are counted instead, so the
+  first accepting alternative whose options fit wins, which is the
+  alternative that the Either at the root would have consumed all tokens with.
+  """
+
+  max_states = 100
+
+  def __init__(self, alternatives):
+    self.alternatives = alternatives
+    names = [leaf.name for a in alternatives for leafs, _, _ in a.positionals for leaf in leafs
+             if type(leaf) is Command]
+    self.classes = [None] + list(OrderedDict.fromkeys(names))
+    start = tuple((0, False) for _ in alternatives)
+    self.states = [start]
+    # (state, class) -> (next state, matching leaf per alternative)
+    self.transitions = OrderedDict([])
+    for state_idx, state in enumerate(self.states):
+      if len(self.states) > self.max_states:
+        raise Irregular('too many states')
+      for class_idx, name in enumerate(self.classes):
+        steps = [None if s is None else alternative.step(s, name) for alternative, s in zip(alternatives, state)]
+        if all(step is None for step in steps):
+          continue
+        target = tuple(None if step is None else step[0] for step in steps)
+        if target not in self.states:
+          self.states.append(target)
+        leafs = tuple(None if step is None else step[1] for step in steps)
+        self.transitions[(state_idx, class_idx)] = (self.states.index(target), leafs)
+    self.accepting = [
+      [idx for idx, (alternative, s) in enumerate(zip(alternatives, state)) if s is not None and alternative.accepts(s)]
+      for state in self.states
+    ]
+
+  @classmethod
+  def compile(cls, root):
+    try:
+      return cls([Alternative(pattern) for pattern in alternatives(root)])
+    except Irregular:
+      return None
+
+
+def alternatives(pattern):
+  if type(pattern) is Either:
+    return sum([alternatives(child) for child in pattern.children], [])
+  if type(pattern) is Required and len(pattern.children) == 1:
+    return alternatives(pattern.children[0])
+  return [pattern]
+
+
+def first_commands(pattern):
+  """Returns the names of the commands that pattern can match first among the
+  positionals, whether it can match an argument first and whether it can match
+  without any positionals."""
+  if type(pattern) is Command:
+    return OrderedDict([(pattern.name, None)]), False, False
+  if type(pattern) is Argument:
+    return OrderedDict([]), True, False
+  if type(pattern) is Option:
+    return OrderedDict([]), False, True
+  names, argument = OrderedDict([]), False
+  if type(pattern) is Either:
+    firsts = [first_commands(child) for child in pattern.children]
+    for child_names, _, _ in firsts:
+      names.update(child_names)
+    return names, any(first[1] for first in firsts), any(first[2] for first in firsts)
+  for child in pattern.children:
+    child_names, child_argument, child_nullable = first_commands(child)
+    names.update(child_names)
+    argument = argument or child_argument
+    # the children of an Optional may be skipped individually
+    if type(pattern) in [Required, OneOrMore] and not child_nullable:
+      return names, argument, False
+  return names, argument, True
+
+
+def dispatch_arms(either):
+  """Groups the children of an Either by the command the first positional must
+  name for them to match. Returns (names, children) pairs, the last pair has no
+  names and lists the children that may match any other first positional.
+  Returns None when every child may match regardless of the first positional."""
+  firsts = []
+  for child in either.children:
+    names, argument, nullable = first_commands(child)
+    firsts.append(None if argument or nullable else names)
+  if all(first is None for first in firsts):
+    return None
+  arms = OrderedDict([])
+  for name in OrderedDict.fromkeys(name for first in firsts if first is not None for name in first):
+    children = tuple(child for child, first in zip(either.children, firsts) if first is None or name in first)
+    arms.setdefault(children, []).append(name)
+  fallback = tuple(child for child, first in zip(either.children, firsts) if first is None)
+  return [(names, list(children)) for children, names in arms.items()] + [([], list(fallback))]
 
 
 def parse_doc(doc):
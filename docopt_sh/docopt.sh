@@ -1,40 +1,65 @@
 #!/usr/bin/env bash
 
 docopt() {
-  "LIBRARY"
-  set -e
+  # docopt_parse() runs in the calling shell, which must not exit on errors
+  ${docopt_direct:-false} || set -e
   # substring of doc where leading & trailing newlines have been trimmed
-  trimmed_doc="DOC VALUE"
+  local trimmed_doc="DOC VALUE"
   # substring of doc containing the Usage: part (i.e. no Options: or other notes)
-  usage="DOC USAGE"
-  # shortened shasum of doc from which the parser was generated
-  digest="DOC DIGEST"
+  local usage="DOC USAGE"
+  # checksum of the doc from which the parser was generated,
+  # prefixed with the algorithm used (a bare digest is a shortened shasum)
+  local digest="DOC DIGEST"
   # 3 lists representing option metadata
   # names for short options
-  shorts=("SHORTS")
+  local shorts=("SHORTS")
   # names for long options
-  longs=("LONGS")
+  local longs=("LONGS")
   # argument counts for options, 0 or 1
-  argcounts=("ARGCOUNTS")
+  local argcounts=("ARGCOUNTS")
+  # indices of the options named -h or --help, each surrounded by spaces,
+  # and the index of --version (-1 if there is none)
+  local help_options="HELP OPTIONS"
+  local version_option="VERSION OPTION"
+  "DEFINE ONCE"
+  "LIBRARY"
+  # sets $match to the index of the option named $1, or false if it is unknown
+  docopt__lookup_option() {
+    case $1 in
+      "OPTION LOOKUP"
+      *) match=false;;
+    esac
+  }
 
   # Nodes. This is the AST representing the parsed doc.
   "NODES"
+  "DEFINED"
 
   # shellcheck disable=2016
-  cat <<<' docopt_exit() {
+  local exit_function=' docopt_exit() {
   [[ -n $1 ]] && printf "%s\n" "$1" >&2
   printf "%s\n" ""DOC USAGE"" >&2
   exit 1
 }'
-  # unset the "var_" prefixed variables that will be used for internal assignment
-  unset "INTERNAL VARNAMES"
+  if ${docopt_direct:-false}; then
+    eval "$exit_function"
+  else
+    printf -- '%s\n' "$exit_function"
+  fi
+  # unset the "var_" prefixed variables that will be used for internal assignment,
+  # docopt_parse() declares them as its locals instead of touching the ones of the caller
+  ${docopt_direct:-false} || unset "INTERNAL VARNAMES"
   # invoke main parsing function
-  parse "ROOT NODE IDX" "$@"
+  docopt__parse "ROOT NODE IDX" "$@" || return
+  # docopt_parse() assigns the variables itself, outside of the locals above
+  ${docopt_direct:-false} && return 0
   # if there are no variables to be set docopt() will exit here
   # shellcheck disable=2157,2140
   "EARLY RETURN"
   # shellcheck disable=2034
-  local prefix=${DOCOPT_PREFIX:-''}
+  local docopt_prefix=${DOCOPT_PREFIX:-''}
+  # Apply the defaults of strings and lists, bools and counts are defaulted where they are output
+  "OUTPUT DEFAULTS"
 
   # Workaround for bash-4.3 bug
   # The following script will not work in bash 4.3.0 (and only that version)
@@ -51,140 +76,175 @@ docopt() {
   # variable names, so instead we just output the `declare`s twice
   # in bash-4.3.
 
-  # Unset exported variables from parent shell,
-  # that may clash with names derived from the doc
-  unset "OUTPUT VARNAMES"
-  # Assign internal varnames to output varnames and set defaults
-  "OUTPUT VARNAMES ASSIGNMENTS"
+  # Output the internal variables as declarations of the output variables,
+  # strings are quoted while bools and counts never need to be
   local docopt_i=0
   for ((docopt_i=0;docopt_i<docopt_decl;docopt_i++)); do
-  declare -p "OUTPUT VARNAMES"
+  "OUTPUT DECLARATIONS"
   done
 }
 
 lib_version_check() {
 if [[ $1 != '"LIBRARY VERSION"' && ${DOCOPT_LIB_CHECK:-true} != 'false' ]]; then
-  printf -- "cat <<'EOM' >&2\nThe version of the included docopt library (%s) \
-does not match the version of the invoking docopt parser (%s)\nEOM\nexit 70\n" \
-    '"LIBRARY VERSION"' "$1"
+  set -- "The version of the included docopt library ("LIBRARY VERSION") \
+does not match the version of the invoking docopt parser ($1)"
+  if ${docopt_direct:-false}; then
+    printf -- "%s\n" "$1" >&2
+    return 70
+  fi
+  printf -- "printf -- '%%s\\\\n' %q >&2\nexit 70\n" "$1"
   exit 70
 fi
 }
 
-parse() {
+docopt_parse() {
+  # Parses the arguments like `eval "$(docopt "$@")"`, but in the calling shell
+  # and without a subshell. Returns 1 when the script should exit with the
+  # status in $docopt_status instead, which is 0 after the help or version has
+  # been printed.
+  local docopt_direct=true docopt_prefix=${DOCOPT_PREFIX:-''} "INTERNAL VARNAMES"
+  docopt_status=0
+  docopt "$@" || return 1
+  "OUTPUT ASSIGNMENTS"
+  return 0
+}
+
+docopt__parse() {
   if ${DOCOPT_DOC_CHECK:-true}; then
     local doc_hash
-    doc_hash=$(printf "%s" "$DOC" | shasum -a 256)
-    if [[ ${doc_hash:0:5} != "$digest" ]]; then
-      stderr "The current usage doc (${doc_hash:0:5}) does not match \
+    if [[ $digest = wsum:* ]]; then
+      docopt__checksum "$DOC"
+    else
+      doc_hash=$(printf "%s" "$DOC" | shasum -a 256)
+      doc_hash=${doc_hash:0:5}
+    fi
+    if [[ $doc_hash != "$digest" ]]; then
+      docopt__stderr "The current usage doc (${doc_hash}) does not match \
 what the parser was generated with (${digest})
 Run \`docopt.sh\` to refresh the parser."
-      _return 70
+      docopt__return 70 || return
     fi
   fi
 
   local root_idx=$1
   shift
-  argv=("$@")
-  parsed_params=()
-  parsed_values=()
-  left=()
-  # testing depth counter, when >0 nodes only check for potential matches
-  # when ==0 leafs will set the actual variable when a match is found
-  testdepth=0
+  # argv is never modified, argv_idx points at the next token to consume
+  local argv=("$@") argv_idx=0 parsed_params=() parsed_values=()
+  # set by docopt__parse_shorts & docopt__parse_long when one of the tokens is --help or --version
+  local help=false version=false
 
   local arg
-  while [[ ${#argv[@]} -gt 0 ]]; do
-    if [[ ${argv[0]} = "--" ]]; then
-      for arg in "${argv[@]}"; do
+  while [[ $argv_idx -lt ${#argv[@]} ]]; do
+    arg=${argv[$argv_idx]}
+    if [[ $arg = "--" ]]; then
+      for arg in "${argv[@]:argv_idx}"; do
         parsed_params+=('a')
         parsed_values+=("$arg")
       done
       break
-    elif [[ ${argv[0]} = --* ]]; then
-      parse_long
-    elif [[ ${argv[0]} = -* && ${argv[0]} != "-" ]]; then
-      parse_shorts
+    elif [[ $arg = --* ]]; then
+      docopt__parse_long || return
+    elif [[ $arg = -* && $arg != "-" ]]; then
+      docopt__parse_shorts || return
     elif ${DOCOPT_OPTIONS_FIRST:-false}; then
-      for arg in "${argv[@]}"; do
+      for arg in "${argv[@]:argv_idx}"; do
         parsed_params+=('a')
         parsed_values+=("$arg")
       done
       break
     else
       parsed_params+=('a')
-      parsed_values+=("${argv[0]}")
-      argv=("${argv[@]:1}")
+      parsed_values+=("$arg")
+      ((argv_idx++)) || true
     fi
   done
-  local idx
-  if ${DOCOPT_ADD_HELP:-true}; then
-    for idx in "${parsed_params[@]}"; do
-      [[ $idx = 'a' ]] && continue
-      if [[ ${shorts[$idx]} = "-h" || ${longs[$idx]} = "--help" ]]; then
-        stdout "$trimmed_doc"
-        _return 0
-      fi
-    done
+  if $help && ${DOCOPT_ADD_HELP:-true}; then
+    docopt__stdout "$trimmed_doc"
+    docopt__return 0 || return
   fi
-  if [[ ${DOCOPT_PROGRAM_VERSION:-false} != 'false' ]]; then
-    for idx in "${parsed_params[@]}"; do
-      [[ $idx = 'a' ]] && continue
-      if [[ ${longs[$idx]} = "--version" ]]; then
-        stdout "$DOCOPT_PROGRAM_VERSION"
-        _return 0
-      fi
-    done
+  if $version && [[ ${DOCOPT_PROGRAM_VERSION:-false} != 'false' ]]; then
+    docopt__stdout "$DOCOPT_PROGRAM_VERSION"
+    docopt__return 0 || return
   fi
 
-  local i=0
-  while [[ $i -lt ${#parsed_params[@]} ]]; do
-    left+=("$i")
-    ((i++)) || true
+  # Leafs always consume the first unconsumed occurrence of their parameter.
+  # heads holds the position of that occurrence for every option index,
+  # arguments & commands are queued after the options at ${#shorts[@]}.
+  # next_param links each position to the next occurrence of its parameter.
+  # journal records the consumed positions in order so that branch nodes can
+  # roll back to a previous number of consumed tokens, assignments holds the
+  # variable assignment of the leaf that consumed the token at the same index.
+  local heads=() next_param=() journal=() assignments=() consumed=0
+  # consumed tokens of matches that are replayed later on, see docopt__stash()
+  local stash_journal=() stash_assignments=()
+  if [[ ${BASH_VERSINFO[0]} -ge 4 ]]; then
+    # results of memoized nodes, keyed by node index and unconsumed tokens
+    local -A memo=()
+  fi
+  local i=${#parsed_params[@]} idx
+  while [[ $((i--)) -gt 0 ]]; do
+    idx=${parsed_params[$i]}
+    [[ $idx = 'a' ]] && idx=${#shorts[@]}
+    next_param[$i]=${heads[$idx]}
+    heads[$idx]=$i
   done
 
-  if ! required "$root_idx" || [ ${#left[@]} -gt 0 ]; then
-    error
+  if ! "docopt__node_$root_idx" || [[ $consumed -lt ${#parsed_params[@]} ]]; then
+    docopt__error || return
   fi
+  # the match succeeded, perform the assignments of all leafs that took part
+  local IFS=$'\n'
+  eval "${assignments[*]:0:consumed}"
   return 0
 }
 
-parse_shorts() {
-  local token=${argv[0]}
+docopt__checksum() {
+  # Builtin-only checksum of $1 stored in $doc_hash, mirrored by doc_checksum()
+  # in bash.py. Punctuation is escaped into base-64 digits, the words are then
+  # folded into a 32 bit polynomial hash via one arithmetic expression.
+  local LC_ALL=C IFS=$' \t\n'
+  local s=$1 words expr h=${#1}
+  s=${s//@/@@}; s=${s//-/@a}; s=${s//\[/@b}; s=${s//\]/@c}; s=${s//\(/@d}
+  s=${s//\)/@e}; s=${s//|/@f}; s=${s//</@g}; s=${s//>/@h}; s=${s//./@i}
+  s=${s//=/@j}; s=${s//,/@k}; s=${s//:/@l}; s=${s//$'\n'/ @n }
+  s=${s//[!0-9a-zA-Z@_ $'\t']/_}
+  # shellcheck disable=2206
+  words=($s)
+  # words are hashed by their first 10 digits and by the ones following those
+  # (words shorter than 10 digits are hashed twice)
+  printf -v expr 'h=(h*65599+64#0%.10s)&4294967295,' \
+    "${words[@]}" "${words[@]#??????????}"
+  ((${expr%,})) || true
+  printf -v doc_hash 'wsum:%08x' "$h"
+}
+
+docopt__parse_shorts() {
+  local token=${argv[$argv_idx]}
   local value
-  argv=("${argv[@]:1}")
-  [[ $token = -* && $token != --* ]] || _return 88
+  ((argv_idx++)) || true
+  [[ $token = -* && $token != --* ]] || { docopt__return 88; return; }
   local remaining=${token#-}
   while [[ -n $remaining ]]; do
     local short="-${remaining:0:1}"
     remaining="${remaining:1}"
-    local i=0
-    local similar=()
-    local match=false
-    for o in "${shorts[@]}"; do
-      if [[ $o = "$short" ]]; then
-        similar+=("$short")
-        [[ $match = false ]] && match=$i
-      fi
-      ((i++)) || true
-    done
-    if [[ ${#similar[@]} -gt 1 ]]; then
-      error "${short} is specified ambiguously ${#similar[@]} times"
-    elif [[ ${#similar[@]} -lt 1 ]]; then
+    local match
+    docopt__lookup_option "$short" || return
+    if [[ $match = false ]]; then
       match=${#shorts[@]}
       value=true
       shorts+=("$short")
       longs+=('')
       argcounts+=(0)
+      [[ $short = -h ]] && help_options+="$match "
     else
       value=false
       if [[ ${argcounts[$match]} -ne 0 ]]; then
         if [[ $remaining = '' ]]; then
-          if [[ ${#argv[@]} -eq 0 || ${argv[0]} = '--' ]]; then
-            error "${short} requires argument"
+          if [[ $argv_idx -ge ${#argv[@]} || ${argv[$argv_idx]} = '--' ]]; then
+            docopt__error "${short} requires argument" || return
           fi
-          value=${argv[0]}
-          argv=("${argv[@]:1}")
+          value=${argv[$argv_idx]}
+          ((argv_idx++)) || true
         else
           value=$remaining
           remaining=''
@@ -194,18 +254,20 @@ parse_shorts() {
         value=true
       fi
     fi
+    [[ $help_options = *" $match "* ]] && help=true
+    [[ $match = "$version_option" ]] && version=true
     parsed_params+=("$match")
     parsed_values+=("$value")
   done
 }
 
-parse_long() {
-  local token=${argv[0]}
+docopt__parse_long() {
+  local token=${argv[$argv_idx]}
   local long=${token%%=*}
   local value=${token#*=}
-  local argcount
-  argv=("${argv[@]:1}")
-  [[ $token = --* ]] || _return 88
+  local argcount eq o
+  ((argv_idx++)) || true
+  [[ $token = --* ]] || { docopt__return 88; return; }
   if [[ $token = *=* ]]; then
     eq='='
   else
@@ -214,16 +276,9 @@ parse_long() {
   fi
   local i=0
   local similar=()
-  local match=false
-  for o in "${longs[@]}"; do
-    if [[ $o = "$long" ]]; then
-      similar+=("$long")
-      [[ $match = false ]] && match=$i
-    fi
-    ((i++)) || true
-  done
+  local match
+  docopt__lookup_option "$long" || return
   if [[ $match = false ]]; then
-    i=0
     for o in "${longs[@]}"; do
       if [[ $o = $long* ]]; then
         similar+=("$long")
@@ -233,93 +288,110 @@ parse_long() {
     done
   fi
   if [[ ${#similar[@]} -gt 1 ]]; then
-    error "${long} is not a unique prefix: ${similar[*]}?"
-  elif [[ ${#similar[@]} -lt 1 ]]; then
+    docopt__error "${long} is not a unique prefix: ${similar[*]}?" || return
+  elif [[ $match = false ]]; then
     [[ $eq = '=' ]] && argcount=1 || argcount=0
     match=${#shorts[@]}
     [[ $argcount -eq 0 ]] && value=true
     shorts+=('')
     longs+=("$long")
     argcounts+=("$argcount")
+    [[ $long = --help ]] && help_options+="$match "
+    [[ $long = --version ]] && version_option=$match
   else
     if [[ ${argcounts[$match]} -eq 0 ]]; then
       if [[ $value != false ]]; then
-        error "${longs[$match]} must not have an argument"
+        docopt__error "${longs[$match]} must not have an argument" || return
       fi
     elif [[ $value = false ]]; then
-      if [[ ${#argv[@]} -eq 0 || ${argv[0]} = '--' ]]; then
-        error "${long} requires argument"
+      if [[ $argv_idx -ge ${#argv[@]} || ${argv[$argv_idx]} = '--' ]]; then
+        docopt__error "${long} requires argument" || return
       fi
-      value=${argv[0]}
-      argv=("${argv[@]:1}")
+      value=${argv[$argv_idx]}
+      ((argv_idx++)) || true
     fi
     if [[ $value = false ]]; then
       value=true
     fi
   fi
+  [[ $help_options = *" $match "* ]] && help=true
+  [[ $match = "$version_option" ]] && version=true
   parsed_params+=("$match")
   parsed_values+=("$value")
 }
 
-required() {
-  local initial_left=("${left[@]}")
+docopt__required() {
+  local initial_consumed=$consumed
   local node_idx
-  ((testdepth++)) || true
   for node_idx in "$@"; do
-    if ! "node_$node_idx"; then
-      left=("${initial_left[@]}")
-      ((testdepth--)) || true
+    if ! "docopt__node_$node_idx"; then
+      docopt__rollback "$initial_consumed"
       return 1
     fi
   done
-  if [[ $((--testdepth)) -eq 0 ]]; then
-    left=("${initial_left[@]}")
-    for node_idx in "$@"; do
-      "node_$node_idx"
-    done
-  fi
   return 0
 }
 
-either() {
-  local initial_left=("${left[@]}")
-  local best_match_idx
+docopt__either() {
+  local initial_consumed=$consumed
+  local best
   local match_count
   local node_idx
-  ((testdepth++)) || true
   for node_idx in "$@"; do
-    if "node_$node_idx"; then
-      if [[ -z $match_count || ${#left[@]} -lt $match_count ]]; then
-        best_match_idx=$node_idx
-        match_count=${#left[@]}
+    if "docopt__node_$node_idx"; then
+      if [[ -z $match_count || $consumed -gt $match_count ]]; then
+        match_count=$consumed
+        best=${#stash_journal[@]}
+        docopt__stash "$initial_consumed"
       fi
     fi
-    left=("${initial_left[@]}")
+    docopt__rollback "$initial_consumed"
   done
-  ((testdepth--)) || true
-  if [[ -n $best_match_idx ]]; then
-    "node_$best_match_idx"
+  if [[ -n $match_count ]]; then
+    # consume the tokens of the best match again instead of re-running it
+    docopt__replay "$best" $((match_count - initial_consumed))
     return 0
   fi
-  left=("${initial_left[@]}")
   return 1
 }
 
-optional() {
+docopt__memoize() {
+  # Runs the helper in $2 for node $1, or replays its result when the node
+  # already ran on the same unconsumed tokens
+  [[ ${BASH_VERSINFO[0]} -ge 4 ]] || { "${@:2}"; return; }
+  local IFS=' '
+  local key="$1 ${heads[*]}"
+  local result=${memo[$key]}
+  if [[ -n $result ]]; then
+    [[ $result = fail ]] && return 1
+    docopt__replay $result
+    return 0
+  fi
+  local initial_consumed=$consumed
+  if "${@:2}"; then
+    memo[$key]="${#stash_journal[@]} $((consumed - initial_consumed))"
+    docopt__stash "$initial_consumed"
+    return 0
+  fi
+  memo[$key]=fail
+  return 1
+}
+
+docopt__optional() {
   local node_idx
   for node_idx in "$@"; do
-    "node_$node_idx"
+    "docopt__node_$node_idx"
   done
   return 0
 }
 
-oneormore() {
+docopt__oneormore() {
   local i=0
-  local prev=${#left[@]}
-  while "node_$1"; do
+  local prev=$consumed
+  while "docopt__node_$1"; do
     ((i++)) || true
-    [[ $prev -eq ${#left[@]} ]] && break
-    prev=${#left[@]}
+    [[ $prev -eq $consumed ]] && break
+    prev=$consumed
   done
   if [[ $i -ge 1 ]]; then
     return 0
@@ -327,82 +399,125 @@ oneormore() {
   return 1
 }
 
-_command() {
-  local i
-  local name=${2:-$1}
-  for i in "${!left[@]}"; do
-    local l=${left[$i]}
-    if [[ ${parsed_params[$l]} = 'a' ]]; then
-      if [[ ${parsed_values[$l]} != "$name" ]]; then
-        return 1
-      fi
-      left=("${left[@]:0:$i}" "${left[@]:((i+1))}")
-      [[ $testdepth -gt 0 ]] && return 0
-      if [[ $3 = true ]]; then
-        eval "((var_$1++)) || true"
-      else
-        eval "var_$1=true"
-      fi
-      return 0
-    fi
+docopt__rollback() {
+  local l
+  local idx
+  while [[ $consumed -gt $1 ]]; do
+    ((consumed--)) || true
+    l=${journal[$consumed]}
+    idx=${parsed_params[$l]}
+    [[ $idx = 'a' ]] && idx=${#shorts[@]}
+    heads[$idx]=$l
   done
-  return 1
 }
 
-switch() {
-  local i
-  for i in "${!left[@]}"; do
-    local l=${left[$i]}
-    if [[ ${parsed_params[$l]} = "$2" ]]; then
-      left=("${left[@]:0:$i}" "${left[@]:((i+1))}")
-      [[ $testdepth -gt 0 ]] && return 0
-      if [[ $3 = true ]]; then
-        eval "((var_$1++))" || true
-      else
-        eval "var_$1=true"
-      fi
-      return 0
-    fi
-  done
-  return 1
+docopt__stash() {
+  # Appends the tokens consumed since there were $1 consumed tokens to the stash
+  stash_journal+=("${journal[@]:$1:consumed-$1}")
+  stash_assignments+=("${assignments[@]:$1:consumed-$1}")
 }
 
-value() {
-  local i
-  for i in "${!left[@]}"; do
-    local l=${left[$i]}
-    if [[ ${parsed_params[$l]} = "$2" ]]; then
-      left=("${left[@]:0:$i}" "${left[@]:((i+1))}")
-      [[ $testdepth -gt 0 ]] && return 0
-      local value
-      value=$(printf -- "%q" "${parsed_values[$l]}")
-      if [[ $3 = true ]]; then
-        eval "var_$1+=($value)"
-      else
-        eval "var_$1=$value"
-      fi
-      return 0
-    fi
+docopt__replay() {
+  # Consumes the $2 tokens at offset $1 in the stash again
+  local i=$1
+  local l
+  local idx
+  while [[ $i -lt $(($1 + $2)) ]]; do
+    l=${stash_journal[$i]}
+    idx=${parsed_params[$l]}
+    [[ $idx = 'a' ]] && idx=${#shorts[@]}
+    heads[$idx]=${next_param[$l]}
+    journal[$consumed]=$l
+    assignments[$consumed]=${stash_assignments[$i]}
+    ((consumed++)) || true
+    ((i++)) || true
   done
-  return 1
 }
 
-stdout() {
-  printf -- "cat <<'EOM'\n%s\nEOM\n" "$1"
+docopt__command() {
+  local l=${heads[${#shorts[@]}]}
+  [[ -n $l && ${parsed_values[$l]} = "${2:-$1}" ]] || return 1
+  heads[${#shorts[@]}]=${next_param[$l]}
+  journal[$consumed]=$l
+  if [[ $3 = true ]]; then
+    assignments[$consumed]="((var_$1++)) || true"
+  else
+    assignments[$consumed]="var_$1=true"
+  fi
+  ((consumed++)) || true
+  return 0
+}
+
+docopt__switch() {
+  local l=${heads[$2]}
+  [[ -n $l ]] || return 1
+  heads[$2]=${next_param[$l]}
+  journal[$consumed]=$l
+  if [[ $3 = true ]]; then
+    assignments[$consumed]="((var_$1++)) || true"
+  else
+    assignments[$consumed]="var_$1=true"
+  fi
+  ((consumed++)) || true
+  return 0
+}
+
+docopt__value() {
+  local idx=$2
+  [[ $idx = 'a' ]] && idx=${#shorts[@]}
+  local l=${heads[$idx]}
+  [[ -n $l ]] || return 1
+  heads[$idx]=${next_param[$l]}
+  journal[$consumed]=$l
+  # refer to the value instead of quoting it, %q would need a subshell
+  if [[ $3 = true ]]; then
+    assignments[$consumed]="var_$1+=(\"\${parsed_values[$l]}\")"
+  else
+    assignments[$consumed]="var_$1=\${parsed_values[$l]}"
+  fi
+  ((consumed++)) || true
+  return 0
+}
+
+docopt__stdout() {
+  # The text is quoted with %q for the caller to print it with the printf builtin
+  if ${docopt_direct:-false}; then
+    printf -- "%s\n" "$1"
+  else
+    printf -- "printf -- '%%s\\\\n' %q\n" "$1"
+  fi
 }
 
-stderr() {
-  printf -- "cat <<'EOM' >&2\n%s\nEOM\n" "$1"
+docopt__stderr() {
+  if ${docopt_direct:-false}; then
+    printf -- "%s\n" "$1" >&2
+  else
+    printf -- "printf -- '%%s\\\\n' %q >&2\n" "$1"
+  fi
 }
 
-error() {
-  [[ -n $1 ]] && stderr "$1"
-  stderr "$usage"
-  _return 1
+docopt__error() {
+  [[ -n $1 ]] && docopt__stderr "$1"
+  docopt__stderr "$usage"
+  docopt__return 1
 }
 
-_return() {
+docopt__return() {
+  # docopt_parse() can only return, the status is left in $docopt_status
+  if ${docopt_direct:-false}; then
+    docopt_status=$1
+    return 1
+  fi
   printf -- "exit %d\n" "$1"
   exit "$1"
 }
 
+
+lib_sentinel() {
+# Parsers of the same version skip sourcing the library once this is defined
+"LIBRARY SENTINEL"() { :; }
+if ${DOCOPT_LIB_EXPORT:-false}; then
+  # Scripts started from this shell inherit the library, bash imports the functions on startup
+  export -f "LIBRARY FUNCTIONS"
+fi
+}
@@ -0,0 +1,399 @@
+#!/bin/sh
+
+docopt() {
+  set -e
+  # doc the parser was generated from, leading & trailing whitespace trimmed.
+  # POSIX sh has no substrings, so it is compared with the one in $DOC instead
+  local generated_doc="DOC VALUE"
+  local trimmed_doc="${DOC#"${DOC%%[![:space:]]*}"}"
+  trimmed_doc="${trimmed_doc%"${trimmed_doc##*[![:space:]]}"}"
+  # the Usage: part of the doc (i.e. no Options: or other notes)
+  local usage="DOC USAGE"
+  # Arrays are emulated with variables that are suffixed by the index.
+  # The number of options, their long names and argument counts (0 or 1)
+  # are in $options, $docopt_long_<idx> and $docopt_argcount_<idx>
+  local options="OPTIONS COUNT"
+  "OPTION METADATA"
+  # indices of the options named -h or --help, each surrounded by spaces,
+  # and the index of --version (-1 if there is none)
+  local help_options="HELP OPTIONS"
+  local version_option="VERSION OPTION"
+  "LIBRARY"
+  # sets $match to the index of the option named $1, or false if it is unknown
+  docopt__lookup_option() {
+    case $1 in
+      "OPTION LOOKUP"
+      *) match=false;;
+    esac
+  }
+
+  # Nodes. This is the AST representing the parsed doc.
+  "NODES"
+
+  docopt__quote "$usage"
+  printf -- '%s\n' 'docopt_exit() {
+  [ -n "$1" ] && printf "%s\n" "$1" >&2
+  printf "%s\n" '"$quoted"' >&2
+  exit 1
+}'
+  # unset the "var_" prefixed variables that will be used for internal assignment
+  unset "INTERNAL VARNAMES"
+  # invoke main parsing function
+  docopt__parse "ROOT NODE IDX" "$@"
+  # if there are no variables to be set docopt() will exit here
+  "EARLY RETURN"
+  local docopt_prefix="${DOCOPT_PREFIX:-}"
+  # Apply the defaults of strings and lists, bools and counts are defaulted where they are output
+  "OUTPUT DEFAULTS"
+
+  # Output the internal variables as assignments of the output variables,
+  # strings and lists are quoted while bools and counts never need to be
+  "OUTPUT DECLARATIONS"
+}
+
+docopt__parse() {
+  if ${DOCOPT_DOC_CHECK:-true}; then
+    if [ "$trimmed_doc" != "$generated_doc" ]; then
+      docopt__stderr "The current usage doc does not match what the parser was generated with
+Run \`docopt.sh\` to refresh the parser."
+      docopt__return 70
+    fi
+  fi
+
+  local root_idx="$1"
+  shift
+  # The tokens are shifted off the positional parameters, docopt__parse_shorts & docopt__parse_long
+  # set $shifted to the number of tokens they consumed. $parsed counts the parameters,
+  # the option index ('a' for positionals) and value of the one at index i are in
+  # $docopt_param_<i> and $docopt_value_<i>
+  local parsed=0 shifted=1
+  # set by docopt__parse_shorts & docopt__parse_long when one of the tokens is --help or --version
+  local help=false version=false
+
+  local arg=
+  while [ $# -gt 0 ]; do
+    case $1 in
+      --) break;;
+      --*) docopt__parse_long "$@";;
+      -?*) docopt__parse_shorts "$@";;
+      *) ! ${DOCOPT_OPTIONS_FIRST:-false} || break
+        eval "docopt_param_$parsed=a; docopt_value_$parsed=\$1"
+        parsed=$((parsed + 1)) shifted=1;;
+    esac
+    shift $shifted
+  done
+  # the tokens from -- on, or from the first positional when options come first
+  for arg in "$@"; do
+    eval "docopt_param_$parsed=a; docopt_value_$parsed=\$arg"
+    parsed=$((parsed + 1))
+  done
+  if $help && ${DOCOPT_ADD_HELP:-true}; then
+    docopt__stdout "$trimmed_doc"
+    docopt__return 0
+  fi
+  if $version && [ "${DOCOPT_PROGRAM_VERSION:-false}" != 'false' ]; then
+    docopt__stdout "$DOCOPT_PROGRAM_VERSION"
+    docopt__return 0
+  fi
+
+  # Leafs always consume the first unconsumed occurrence of their parameter.
+  # docopt_head_<idx> holds the index of that occurrence for every option index,
+  # arguments & commands are queued after the options at $options.
+  # docopt_next_<i> links each parameter to the next occurrence of its option.
+  # docopt_journal_<n> records the consumed parameters in order so that branch
+  # nodes can roll back to a previous number of consumed tokens,
+  # docopt_assignment_<n> holds the variable assignment of the leaf that consumed
+  # the parameter. The stash_journal & stash_assignment ones hold $stashed
+  # consumed tokens of matches that are replayed later on, see docopt__stash()
+  local consumed=0 stashed=0 i=0 idx=
+  while [ $i -le "$options" ]; do
+    eval "docopt_head_$i="
+    i=$((i + 1))
+  done
+  i=$parsed
+  while [ $i -gt 0 ]; do
+    i=$((i - 1))
+    eval "idx=\$docopt_param_$i"
+    [ "$idx" = a ] && idx=$options
+    eval "docopt_next_$i=\$docopt_head_$idx; docopt_head_$idx=$i"
+  done
+
+  if ! "docopt__node_$root_idx" || [ $consumed -lt $parsed ]; then
+    docopt__error
+  fi
+  # the match succeeded, perform the assignments of all leafs that took part
+  i=0
+  while [ $i -lt $consumed ]; do
+    eval "eval \"\$docopt_assignment_$i\""
+    i=$((i + 1))
+  done
+  return 0
+}
+
+docopt__parse_shorts() {
+  local remaining="${1#-}" short= value= match=
+  shifted=1
+  while [ -n "$remaining" ]; do
+    # the first character is what remains when the others are removed
+    value="${remaining#?}"
+    short="-${remaining%"$value"}"
+    remaining="$value"
+    docopt__lookup_option "$short"
+    if [ "$match" = false ]; then
+      match=$options
+      options=$((options + 1))
+      value=true
+      eval "docopt_long_$match=; docopt_argcount_$match=0"
+      [ "$short" = -h ] && help_options="$help_options$match "
+    else
+      value=false
+      if eval "[ \$docopt_argcount_$match -ne 0 ]"; then
+        if [ -z "$remaining" ]; then
+          if [ $# -lt 2 ] || [ "$2" = '--' ]; then
+            docopt__error "${short} requires argument"
+          fi
+          value="$2"
+          shifted=2
+        else
+          value="$remaining"
+          remaining=
+        fi
+      fi
+      if [ "$value" = false ]; then
+        value=true
+      fi
+    fi
+    case $help_options in
+      *" $match "*) help=true;;
+    esac
+    [ "$match" = "$version_option" ] && version=true
+    eval "docopt_param_$parsed=\$match; docopt_value_$parsed=\$value"
+    parsed=$((parsed + 1))
+  done
+}
+
+docopt__parse_long() {
+  local long="${1%%=*}" value="${1#*=}" argcount= eq= o=
+  shifted=1
+  case $1 in
+    *=*) eq='=';;
+    *) value=false;;
+  esac
+  local i=0 similar= similar_count=0 match=
+  docopt__lookup_option "$long"
+  if [ "$match" = false ]; then
+    while [ $i -lt "$options" ]; do
+      eval "o=\$docopt_long_$i"
+      case $o in
+        "$long"*) similar="${similar:+$similar }$long" similar_count=$((similar_count + 1))
+          [ "$match" = false ] && match=$i;;
+      esac
+      i=$((i + 1))
+    done
+  fi
+  if [ $similar_count -gt 1 ]; then
+    docopt__error "${long} is not a unique prefix: ${similar}?"
+  elif [ "$match" = false ]; then
+    if [ "$eq" = '=' ]; then
+      argcount=1
+    else
+      argcount=0
+      value=true
+    fi
+    match=$options
+    options=$((options + 1))
+    eval "docopt_long_$match=\$long; docopt_argcount_$match=\$argcount"
+    [ "$long" = --help ] && help_options="$help_options$match "
+    [ "$long" = --version ] && version_option=$match
+  else
+    if eval "[ \$docopt_argcount_$match -eq 0 ]"; then
+      if [ "$value" != false ]; then
+        eval "docopt__error \"\$docopt_long_$match must not have an argument\""
+      fi
+    elif [ "$value" = false ]; then
+      if [ $# -lt 2 ] || [ "$2" = '--' ]; then
+        docopt__error "${long} requires argument"
+      fi
+      value="$2"
+      shifted=2
+    fi
+    if [ "$value" = false ]; then
+      value=true
+    fi
+  fi
+  case $help_options in
+    *" $match "*) help=true;;
+  esac
+  [ "$match" = "$version_option" ] && version=true
+  eval "docopt_param_$parsed=\$match; docopt_value_$parsed=\$value"
+  parsed=$((parsed + 1))
+}
+
+docopt__required() {
+  local initial_consumed=$consumed node_idx=
+  for node_idx in "$@"; do
+    if ! "docopt__node_$node_idx"; then
+      docopt__rollback "$initial_consumed"
+      return 1
+    fi
+  done
+  return 0
+}
+
+docopt__either() {
+  local initial_consumed=$consumed best= match_count= node_idx=
+  for node_idx in "$@"; do
+    if "docopt__node_$node_idx"; then
+      if [ -z "$match_count" ] || [ $consumed -gt "$match_count" ]; then
+        match_count=$consumed
+        best=$stashed
+        docopt__stash "$initial_consumed"
+      fi
+    fi
+    docopt__rollback "$initial_consumed"
+  done
+  if [ -n "$match_count" ]; then
+    # consume the tokens of the best match again instead of re-running it
+    docopt__replay "$best" $((match_count - initial_consumed))
+    return 0
+  fi
+  return 1
+}
+
+docopt__optional() {
+  local node_idx=
+  for node_idx in "$@"; do
+    "docopt__node_$node_idx"
+  done
+  return 0
+}
+
+docopt__oneormore() {
+  local i=0 prev=$consumed
+  while "docopt__node_$1"; do
+    i=$((i + 1))
+    [ "$prev" -eq $consumed ] && break
+    prev=$consumed
+  done
+  if [ $i -ge 1 ]; then
+    return 0
+  fi
+  return 1
+}
+
+docopt__rollback() {
+  local l= idx=
+  while [ $consumed -gt "$1" ]; do
+    consumed=$((consumed - 1))
+    eval "l=\$docopt_journal_$consumed"
+    eval "idx=\$docopt_param_$l"
+    [ "$idx" = a ] && idx=$options
+    eval "docopt_head_$idx=$l"
+  done
+}
+
+docopt__stash() {
+  # Appends the tokens consumed since there were $1 consumed tokens to the stash
+  local i="$1"
+  while [ "$i" -lt $consumed ]; do
+    eval "docopt_stash_journal_$stashed=\$docopt_journal_$i"
+    eval "docopt_stash_assignment_$stashed=\$docopt_assignment_$i"
+    stashed=$((stashed + 1))
+    i=$((i + 1))
+  done
+}
+
+docopt__replay() {
+  # Consumes the $2 tokens at offset $1 in the stash again
+  local i="$1" l= idx=
+  while [ "$i" -lt $(($1 + $2)) ]; do
+    eval "l=\$docopt_stash_journal_$i"
+    eval "idx=\$docopt_param_$l"
+    [ "$idx" = a ] && idx=$options
+    eval "docopt_head_$idx=\$docopt_next_$l; docopt_journal_$consumed=$l"
+    eval "docopt_assignment_$consumed=\$docopt_stash_assignment_$i"
+    consumed=$((consumed + 1))
+    i=$((i + 1))
+  done
+}
+
+docopt__command() {
+  local l= value=
+  eval "l=\$docopt_head_$options"
+  [ -n "$l" ] || return 1
+  eval "value=\$docopt_value_$l"
+  [ "$value" = "${2:-$1}" ] || return 1
+  eval "docopt_head_$options=\$docopt_next_$l; docopt_journal_$consumed=$l"
+  if [ "$3" = true ]; then
+    eval "docopt_assignment_$consumed='var_$1=\$((var_$1 + 1))'"
+  else
+    eval "docopt_assignment_$consumed='var_$1=true'"
+  fi
+  consumed=$((consumed + 1))
+  return 0
+}
+
+docopt__switch() {
+  local l=
+  eval "l=\$docopt_head_$2"
+  [ -n "$l" ] || return 1
+  eval "docopt_head_$2=\$docopt_next_$l; docopt_journal_$consumed=$l"
+  if [ "$3" = true ]; then
+    eval "docopt_assignment_$consumed='var_$1=\$((var_$1 + 1))'"
+  else
+    eval "docopt_assignment_$consumed='var_$1=true'"
+  fi
+  consumed=$((consumed + 1))
+  return 0
+}
+
+docopt__value() {
+  local idx="$2" l=
+  [ "$idx" = a ] && idx=$options
+  eval "l=\$docopt_head_$idx"
+  [ -n "$l" ] || return 1
+  eval "docopt_head_$idx=\$docopt_next_$l; docopt_journal_$consumed=$l"
+  # refer to the value instead of quoting it, lists are strings of quoted words
+  if [ "$3" = true ]; then
+    eval "docopt_assignment_$consumed='docopt__quote \"\$docopt_value_$l\"; var_$1=\"\${var_$1:+\$var_$1 }\$quoted\"'"
+  else
+    eval "docopt_assignment_$consumed='var_$1=\$docopt_value_$l'"
+  fi
+  consumed=$((consumed + 1))
+  return 0
+}
+
+docopt__quote() {
+  # Stores $1 in $quoted as a single quoted word for the caller to eval
+  local rest="$1"
+  quoted=
+  while :; do
+    case $rest in
+      *\'*) quoted="$quoted${rest%%\'*}'\\''" rest="${rest#*\'}";;
+      *) break;;
+    esac
+  done
+  quoted="'$quoted$rest'"
+}
+
+docopt__stdout() {
+  # The text is quoted for the caller to print it with the printf builtin
+  docopt__quote "$1"
+  printf -- "printf -- '%%s\\\\n' %s\n" "$quoted"
+}
+
+docopt__stderr() {
+  docopt__quote "$1"
+  printf -- "printf -- '%%s\\\\n' %s >&2\n" "$quoted"
+}
+
+docopt__error() {
+  [ -n "$1" ] && docopt__stderr "$1"
+  docopt__stderr "$usage"
+  docopt__return 1
+}
+
+docopt__return() {
+  printf -- "exit %d\n" "$1"
+  exit "$1"
+}
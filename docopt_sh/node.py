@@ -1,64 +1,107 @@
-from .doc_ast import Option, Command, Required, Optional, OptionsShortcut, OneOrMore, Either
-from .bash import Code, bash_variable_name, bash_variable_value, bash_ifs_value
+from collections import OrderedDict
+from shlex import quote
+from .doc_ast import Option, Command, Required, Optional, OptionsShortcut, OneOrMore, Either, dispatch_arms
+from .bash import Code, indent, bash_variable_name, bash_variable_value, bash_ifs_value
 
+# The functions of the parser are prefixed with docopt__, docopt_parse() defines them
+# in the calling shell where they must not replace the functions of the script
 helper_map = {
-  Required: 'required',
-  Optional: 'optional',
-  OptionsShortcut: 'optional',
-  OneOrMore: 'oneormore',
-  Either: 'either',
+  Required: 'docopt__required',
+  Optional: 'docopt__optional',
+  OptionsShortcut: 'docopt__optional',
+  OneOrMore: 'docopt__oneormore',
+  Either: 'docopt__either',
 }
 helper_list = list(helper_map.values()) + [
-  'switch',
-  '_command',
-  'value',
+  'docopt__switch',
+  'docopt__command',
+  'docopt__value',
+  'docopt__memoize',
+  'docopt__stash',
+  'docopt__replay',
 ]
+# helpers that call other helpers
+helper_dependencies = {
+  'docopt__either': ['docopt__stash', 'docopt__replay'],
+  'docopt__memoize': ['docopt__stash', 'docopt__replay'],
+}
 
 
 class Node(Code):
 
+  memoized = False
+
   def __init__(self, pattern, body, idx):
     self.pattern = pattern
     self.idx = idx
     code = '{name}(){{\n{body}\n}}\n'.format(
-      name='node_' + str(idx),
+      name='docopt__node_' + str(idx),
       body=body,
     )
     super(Node, self).__init__(code)
 
+  @property
+  def helper_names(self):
+    names = [self.helper_name] + (['docopt__memoize'] if self.memoized else [])
+    return names + [d for name in names for d in helper_dependencies.get(name, [])]
+
 
 class BranchNode(Node):
 
-  def __init__(self, pattern, idx, node_map):
+  def __init__(self, pattern, idx, node_map, memoize=False, dispatch=True):
     # minify arg list by only specifying node idx
     child_indexes = map(lambda child: node_map[child].idx, pattern.children)
     self.helper_name = helper_map[type(pattern)]
-    body = '  {helper} {args}'.format(
-      helper=self.helper_name,
-      args=' '.join(list(map(str, child_indexes))),
-    )
+    self.memoized = memoize
+    arms = dispatch_arms(pattern) if type(pattern) is Either and not memoize and dispatch else None
+    if arms is None:
+      body = '  {helper} {args}'.format(
+        helper=('docopt__memoize %d %s' % (idx, self.helper_name)) if memoize else self.helper_name,
+        args=' '.join(list(map(str, child_indexes))),
+      )
+    else:
+      body = self.dispatch(arms, node_map)
     super(BranchNode, self).__init__(pattern, body, idx)
 
+  def dispatch(self, arms, node_map):
+    # Only the children that can match the first unconsumed positional are tried,
+    # the others would fail on the command they start with anyway
+    lines = []
+    for names, children in arms:
+      if len(children) == 0:
+        command = 'return 1'
+      elif len(children) == 1:
+        command = 'docopt__node_%d' % node_map[children[0]].idx
+      else:
+        command = 'docopt__either ' + ' '.join(str(node_map[child].idx) for child in children)
+      lines.append('    %s) %s;;' % ('|'.join(map(bash_ifs_value, names)) or '*', command))
+    return '\n'.join([
+      '  local l=${heads[${#shorts[@]}]}',
+      '  case ${l:+${parsed_values[$l]}} in',
+    ] + lines + ['  esac'])
+
 
 class LeafNode(Node):
 
   def __init__(self, pattern, idx):
     default_value = pattern.value
     if type(pattern) is Option:
-      self.helper_name = 'switch' if type(default_value) in [bool, int] else 'value'
+      self.helper_name = 'docopt__switch' if type(default_value) in [bool, int] else 'docopt__value'
       needle = idx
     elif type(pattern) is Command:
-      self.helper_name = '_command'
+      self.helper_name = 'docopt__command'
       needle = pattern.name
     else:  # type is Argument
-      self.helper_name = 'value'
+      self.helper_name = 'docopt__value'
       needle = 'a'
+    self.needle = needle
     self.variable_name = bash_variable_name(pattern.name)
+    self.repeating = type(default_value) in [list, int]
 
     args = [self.variable_name, bash_ifs_value(needle)]
-    if type(default_value) in [list, int]:
+    if self.repeating:
       args.append(bash_ifs_value(True))
-    elif self.helper_name == '_command' and args[0] == args[1]:
+    elif self.helper_name == 'docopt__command' and args[0] == args[1]:
       args = [args[0]]
     body = '  {helper} {args}'.format(
       helper=self.helper_name,
@@ -66,20 +109,294 @@ class LeafNode(Node):
     )
 
     if type(default_value) is list:
-      default_tpl = (
-        'if declare -p {docopt_name} >/dev/null 2>&1; then\n'
-        '  eval "${{prefix}}"\'{name}=("${{{docopt_name}[@]}}")\'\n'
-        'else\n'
-        '  eval "${{prefix}}"\'{name}={default}\'\n'
-        'fi'
-      )
+      self.value_type = 'list'
+    elif type(default_value) is bool:
+      self.value_type = 'bool'
+    elif type(default_value) is int:
+      self.value_type = 'count'
     else:
-      default_tpl = (
-        'eval "${{prefix}}"\'{name}=${{{docopt_name}:-{default}}}\''
-      )
-    self.default_assignment = default_tpl.format(
-      name=self.variable_name,
-      docopt_name='var_' + self.variable_name,
-      default=bash_variable_value(default_value)
-    )
+      self.value_type = 'string'
+    self.default = bash_variable_value(default_value)
     super(LeafNode, self).__init__(pattern, body, idx)
+
+  def output_default(self):
+    # Sets the default of the internal variable before its value is output by docopt(),
+    # bools and counts are defaulted where they are output
+    name = 'var_' + self.variable_name
+    if self.value_type == 'list' and self.default != '()':
+      return '[[ ${{#{name}[@]}} -gt 0 ]] || {name}={default}'.format(name=name, default=self.default)
+    if self.value_type == 'string' and self.default != '':
+      return '{name}=${{{name}:-{default}}}'.format(name=name, default=self.default)
+    return None
+
+  def output_assignment(self, prefix):
+    # Assigns the output variable in docopt_parse(). The name is only known when
+    # DOCOPT_PREFIX is a constant in the script, otherwise it is assigned with eval
+    name = 'var_' + self.variable_name
+    if self.value_type == 'list':
+      value = '("${%s[@]}")' % name
+    else:
+      value = '${%s:-%s}' % (name, self.default)
+    if prefix is None:
+      assignment = 'eval "${docopt_prefix}"%s' % quote(self.variable_name + '=' + value)
+      default = 'eval "${docopt_prefix}"%s' % quote(self.variable_name + '=' + self.default)
+    else:
+      assignment = prefix + self.variable_name + '=' + value
+      default = prefix + self.variable_name + '=' + self.default
+    if self.value_type == 'list' and self.default != '()':
+      return 'if [[ ${{#{name}[@]}} -gt 0 ]]; then\n  {assignment}\nelse\n  {default}\nfi'.format(
+        name=name, assignment=assignment, default=default)
+    return assignment
+
+
+class LazyNode(Node):
+
+  def __init__(self, node, nodes):
+    # Defines the nodes of an alternative when it is tried for the first time,
+    # until then bash only has to read a string literal instead of the functions
+    self.nodes = nodes
+    definitions = indent('\n'.join(str(n).strip() for n in nodes)).strip()
+    body = "  eval '{definitions}'\n  docopt__node_{idx}".format(
+      definitions=definitions.replace("'", "'\\''"),
+      idx=node.idx,
+    )
+    super(LazyNode, self).__init__(node.pattern, body, node.idx)
+
+  @property
+  def helper_names(self):
+    return [name for n in self.nodes for name in n.helper_names]
+
+
+class InlineNode(Node):
+
+  def __init__(self, pattern, idx, doc_ast):
+    # Matches the subtree in a single function with the helpers and leafs inlined,
+    # shared branches are left to their own function (see DocAst.shared)
+    self.doc_ast = doc_ast
+    self.variables = ['l']
+    self.helpers = set()
+    lines = self.inline(pattern, top=True)
+    if lines[0] == '{' and lines[-1] == '}':
+      lines = [line[2:] for line in lines[1:-1]]
+    body = '\n'.join(['local ' + ' '.join(self.variables)] + lines)
+    super(InlineNode, self).__init__(pattern, indent(body), idx)
+
+  @property
+  def helper_names(self):
+    return list(self.helpers)
+
+  def inline(self, pattern, top=False):
+    # Returns the lines of a single command that consumes the tokens matching pattern.
+    # Like the helpers, the command leaves the tokens as they were when it fails.
+    node = self.doc_ast.node_map[pattern]
+    if type(node) is LeafNode:
+      return self.inline_leaf(node)
+    if pattern in self.doc_ast.shared and not top:
+      if node.memoized:
+        self.helpers.update(['docopt__memoize'] + helper_dependencies['docopt__memoize'])
+        return ['docopt__memoize %d docopt__node_%d' % (node.idx, node.idx)]
+      return ['docopt__node_%d' % node.idx]
+    children = [self.inline(child) for child in pattern.children]
+    if type(pattern) is Required:
+      if len(children) == 0:
+        return ['true']
+      if len(children) == 1:
+        return children[0]
+      initial = self.variable('c', node)
+      lines = ['%s=$consumed' % initial]
+      lines += chain(' || ', [chain(' && ', children), block(['docopt__rollback "$%s"' % initial, 'false'])])
+      return block(lines)
+    if type(pattern) in [Optional, OptionsShortcut]:
+      return block(sum(children, []) + ['true'])
+    if type(pattern) is OneOrMore:
+      count, prev = self.variable('n', node), self.variable('p', node)
+      lines = ['%s=0' % count, '%s=$consumed' % prev]
+      lines += wrap('while ', children[0], '; do')
+      lines += indent_lines([
+        '((++%s))' % count,
+        '[[ $%s -eq $consumed ]] && break' % prev,
+        '%s=$consumed' % prev,
+      ])
+      lines += ['done', '((%s))' % count]
+      return block(lines)
+    # type is Either
+    self.helpers.update(helper_dependencies['docopt__either'])
+    initial, best, match_count = self.variable('c', node), self.variable('b', node), self.variable('m', node)
+    lines = ['%s=$consumed' % initial, '%s=' % match_count]
+    for child in children:
+      lines += wrap('if ', child, ' && [[ -z ${0} || $consumed -gt ${0} ]]; then'.format(match_count))
+      lines += indent_lines([
+        '%s=$consumed' % match_count,
+        '%s=${#stash_journal[@]}' % best,
+        'docopt__stash "$%s"' % initial,
+      ])
+      lines += ['fi', 'docopt__rollback "$%s"' % initial]
+    # consume the tokens of the best match again instead of re-running it
+    lines.append('[[ -n ${0} ]] && docopt__replay "${1}" $(({0} - {2}))'.format(match_count, best, initial))
+    return block(lines)
+
+  def inline_leaf(self, node):
+    pattern = node.pattern
+    # arguments & commands are queued after the options, including the ones that
+    # the tokenizer registers for unknown options at runtime
+    key = str(node.idx) if type(pattern) is Option else '${#shorts[@]}'
+    condition = '[[ -n $l ]]'
+    if type(pattern) is Command:
+      condition = '[[ -n $l && ${parsed_values[$l]} = %s ]]' % bash_ifs_value(pattern.name)
+    if node.helper_name == 'docopt__value':
+      # refer to the value instead of quoting it, %q would need a subshell
+      if node.repeating:
+        assignment = '"var_%s+=(\\"\\${parsed_values[$l]}\\")"' % node.variable_name
+      else:
+        assignment = '"var_%s=\\${parsed_values[$l]}"' % node.variable_name
+    elif node.repeating:
+      assignment = "'((var_%s++)) || true'" % node.variable_name
+    else:
+      assignment = "'var_%s=true'" % node.variable_name
+    return block([
+      'l=${heads[%s]}' % key,
+      condition + ' && {',
+    ] + indent_lines([
+      'heads[%s]=${next_param[$l]}' % key,
+      'journal[consumed]=$l',
+      'assignments[consumed]=' + assignment,
+      '((++consumed))',
+    ]) + ['}'])
+
+  def variable(self, prefix, node):
+    name = '%s%d' % (prefix, node.idx)
+    if name not in self.variables:
+      self.variables.append(name)
+    return name
+
+
+class AutomatonNode(Node):
+
+  def __init__(self, automaton, idx, node_map):
+    # Matches the usage by reading every token once, see doc_ast.Automaton.
+    # Positionals advance the automaton and the leaf that matches them in each
+    # alternative is recorded in a fixed-width string, options are counted.
+    width = len(str(max([0] + [n.idx for n in node_map.values() if type(n) is LeafNode])))
+    classes = ['%s) class=%d;;' % (bash_ifs_value(name), idx) for idx, name in enumerate(automaton.classes) if idx > 0]
+    transitions = []
+    for state_idx in range(len(automaton.states)):
+      outcomes = OrderedDict([])
+      for class_idx in range(len(automaton.classes)):
+        outcome = 'return 1'
+        if (state_idx, class_idx) in automaton.transitions:
+          target_idx, leafs = automaton.transitions[(state_idx, class_idx)]
+          outcome = 'state=%d leafs[i]=%s' % (target_idx, ''.join(
+            str(0 if leaf is None else node_map[leaf].idx).zfill(width) for leaf in leafs))
+        outcomes.setdefault(outcome, []).append(class_idx)
+      # the most common outcome is the fallback for the classes of the state
+      fallback = max(outcomes.keys(), key=lambda outcome: len(outcomes[outcome]))
+      for outcome, class_idxs in outcomes.items():
+        if outcome != fallback:
+          transitions.append('%s) %s;;' % ('|'.join('%d.%d' % (state_idx, c) for c in class_idxs), outcome))
+      if fallback != 'return 1':
+        transitions.append('%d.*) %s;;' % (state_idx, fallback))
+    accepting = ['%d) alternatives=(%s);;' % (state_idx, ' '.join(map(str, alternatives)))
+                 for state_idx, alternatives in enumerate(automaton.accepting) if alternatives]
+    options_count = len([n for n in node_map.values() if type(n) is LeafNode and type(n.pattern) is Option])
+    checks = ['%d) %s;;' % (idx, option_rules(alternative, node_map, options_count))
+              for idx, alternative in enumerate(automaton.alternatives)]
+    body = self.template.format(
+      classes=indent('\n'.join(classes + ['*) class=0;;']), level=4),
+      transitions=indent('\n'.join(transitions + ['*) return 1;;']), level=4),
+      accepting=indent('\n'.join(accepting + ['*) return 1;;']), level=2),
+      checks=indent('\n'.join(checks), level=3),
+      width=width,
+    )
+    self.helper_name = None
+    super(AutomatonNode, self).__init__(None, body, idx)
+
+  @property
+  def helper_names(self):
+    return []
+
+  template = '''  local i=0 state=0 class k j rules winner counts=() leafs=() alternatives=()
+  while [[ $i -lt ${{#parsed_params[@]}} ]]; do
+    if [[ ${{parsed_params[$i]}} = a ]]; then
+      case ${{parsed_values[$i]}} in
+{classes}
+      esac
+      case $state.$class in
+{transitions}
+      esac
+    else
+      ((counts[parsed_params[i]]++)) || true
+    fi
+    ((i++)) || true
+  done
+  # the first alternative that accepts the positionals and all options wins,
+  # rules has an "o" for options allowed once and an "m" for repeatable ones
+  case $state in
+{accepting}
+  esac
+  for k in "${{alternatives[@]}}"; do
+    case $k in
+{checks}
+    esac
+    for j in "${{!counts[@]}}"; do
+      case ${{rules:j:1}} in
+        m) ;;
+        o) [[ ${{counts[$j]}} -eq 1 ]] || continue 2;;
+        *) continue 2;;
+      esac
+    done
+    winner=$k
+    break
+  done
+  [[ -n $winner ]] || return 1
+  k=$winner
+  for ((i = 0; i < ${{#parsed_params[@]}}; i++)); do
+    if [[ ${{parsed_params[$i]}} = a ]]; then
+      "docopt__node_$((10#${{leafs[i]:k*{width}:{width}}}))"
+    else
+      "docopt__node_${{parsed_params[$i]}}"
+    fi
+  done'''
+
+
+def option_rules(alternative, node_map, options_count):
+  # sets $rules for the alternative and continues with the next one when
+  # required options are missing or more than one option of a group is specified
+  rules = ['n'] * options_count
+  conditions = []
+  for option, (min, max) in alternative.options.items():
+    idx = node_map[option].idx
+    rules[idx] = 'o' if max == 1 else 'm'
+    if min > 0:
+      conditions.append('counts[%d] >= %d' % (idx, min))
+  for options, required in alternative.groups:
+    for option in options:
+      rules[node_map[option].idx] = 'o'
+    conditions.append('%s %s 1' % (
+      ' + '.join('counts[%d]' % node_map[option].idx for option in options), '==' if required else '<='))
+  code = 'rules=%s' % (''.join(rules) or "''")
+  if conditions:
+    code += '; ((%s)) || continue' % ' && '.join(conditions)
+  return code
+
+
+def indent_lines(lines):
+  return ['  ' + line for line in lines]
+
+
+def block(lines):
+  return ['{'] + indent_lines(lines) + ['}']
+
+
+def wrap(prefix, lines, suffix):
+  # makes the command in lines part of a compound command
+  if len(lines) == 1:
+    return [prefix + lines[0] + suffix]
+  return [prefix + lines[0]] + lines[1:-1] + [lines[-1] + suffix]
+
+
+def chain(operator, commands):
+  # joins commands with an operator like && or ||
+  lines = list(commands[0])
+  for command in commands[1:]:
+    lines = lines[:-1] + [lines[-1] + operator + command[0]] + command[1:]
+  return lines
@@ -1,13 +1,12 @@
 import os.path
 import re
-import hashlib
 import logging
 import shlex
 from collections import OrderedDict
 from . import __version__, DocoptError
-from .doc_ast import DocAst, Option
-from .bash import Code, indent, bash_ifs_value, minify
-from .node import LeafNode, helper_list
+from .doc_ast import DocAst, Option, Required, Either
+from .bash import Code, indent, bash_ifs_value, minify, doc_checksum
+from .node import LeafNode, BranchNode, InlineNode, LazyNode, AutomatonNode, helper_list
 
 log = logging.getLogger(__name__)
 
@@ -16,7 +15,7 @@ class Parser(object):
 
   def __init__(self, parser_parameters):
     self.parameters = parser_parameters
-    self.library = Library()
+    self.library = Library(self.parameters.target)
     self.shellcheck_ignores = [
       '2016',  # Ignore unexpanded variables in single quotes (used for docopt_exit generation)
     ]
@@ -33,6 +32,8 @@ class Parser(object):
       )
 
   def generate(self, script):
+    if self.parameters.target == 'posix':
+      return self.generate_posix(script)
     stripped_doc = '${{DOC:{start}:{length}}}'.format(
       start=script.doc.trimmed_value_start,
       length=len(script.doc.trimmed_value),
@@ -45,45 +46,534 @@ class Parser(object):
       length=str(usage_end - usage_start),
     )
 
+    leaf_nodes = [n for n in doc_ast.nodes if type(n) is LeafNode]
+    prefix = next(option.constant for option in script.options if option.name == 'DOCOPT_PREFIX')
+    # The docopts compatible array is only output when the script sets DOCOPT_ARRAY,
+    # and exclusively when it sets it to a literal name
+    array_option = next(option for option in script.options if option.name == 'DOCOPT_ARRAY')
+    if not array_option.present or array_option.constant == '':
+      output = 'variables'
+    elif array_option.constant is None:
+      output = 'both'
+    else:
+      output = 'array'
+    option_nodes = [node for node in leaf_nodes if type(node.pattern) is Option]
+    if self.parameters.codegen == 'auto' and doc_ast.automaton is not None and leaf_nodes:
+      nodes = leaf_nodes + [AutomatonNode(doc_ast.automaton, doc_ast.root_node.idx, doc_ast.node_map)]
+    elif self.parameters.codegen == 'inline':
+      functions = [doc_ast.root_node.pattern] + [p for p in doc_ast.node_map.keys() if p in doc_ast.shared]
+      nodes = [InlineNode(p, doc_ast.node_map[p].idx, doc_ast) for p in functions]
+    elif self.parameters.codegen == 'lazy':
+      nodes = lazy_nodes(doc_ast)
+    else:
+      nodes = doc_ast.nodes
+
+    settings = self.folded_settings(script)
+    features = doc_ast.features | set(['direct'] if script.invocation.parse_function else [])
     if self.parameters.library_path:
-      library = indent('''source {path} '{version}' || {{
+      # The library is only sourced when the same version has not been loaded already,
+      # lib_version_check would let it pass in that case anyway
+      library = indent('''declare -F {sentinel} >/dev/null || source {path} '{version}' || {{
   ret=$?
+  if ${{docopt_direct:-false}}; then
+    docopt_status=$ret
+    return 1
+  fi
   printf -- "exit %d\\n" "$ret"
   exit "$ret"
-}}'''.format(path=self.parameters.library_path, version=__version__), level=1)
+}}'''.format(path=self.parameters.library_path, version=__version__, sentinel=self.library.sentinel), level=1)
     else:
-      helpers_needed = set([n.helper_name for n in doc_ast.nodes])
-      exclude = set(['docopt', 'lib_version_check'] + helper_list) - helpers_needed
-      library = indent(str(self.library.generate_code(exclude=exclude)), level=1)
-
-    leaf_nodes = [n for n in doc_ast.nodes if type(n) is LeafNode]
-    option_nodes = [node for node in leaf_nodes if type(node.pattern) is Option]
+      helpers_needed = set([name for n in nodes for name in n.helper_names])
+      exclude = set(['docopt', 'docopt_parse', 'lib_version_check', 'lib_sentinel'] + helper_list) - helpers_needed
+      if settings.get('DOCOPT_DOC_CHECK') == 'false':
+        exclude.add('docopt__checksum')
+      features.update(set(helper_list) - exclude)
+      # The parser's digest is always calculated by checksum(), unless the doc check is folded away
+      if 'docopt__checksum' not in exclude:
+        features.add('wsum')
+      library = indent(str(Code([
+        shake(name, fold_settings(name, str(code), settings), features)
+        for name, code in self.library.functions.items() if name not in exclude
+      ])), level=1)
 
     replacements = {
       '  "LIBRARY"': library,
       '"DOC VALUE"': stripped_doc,
       '"DOC USAGE"': usage_doc,
-      '"DOC DIGEST"': hashlib.sha256(script.doc.untrimmed_value.encode('utf-8')).hexdigest()[0:5],
+      '"DOC DIGEST"': doc_checksum(script.doc.untrimmed_value),
       '"SHORTS"': ' '.join([bash_ifs_value(o.pattern.short) for o in option_nodes]),
       '"LONGS"': ' '.join([bash_ifs_value(o.pattern.long) for o in option_nodes]),
       '"ARGCOUNTS"': ' '.join([bash_ifs_value(o.pattern.argcount) for o in option_nodes]),
-      '  "NODES"': indent('\n'.join(map(str, list(doc_ast.nodes))), level=1),
-      '  "OUTPUT VARNAMES ASSIGNMENTS"': indent('\n'.join([node.default_assignment for node in leaf_nodes]), level=1),
+      '"HELP OPTIONS"': bash_ifs_value(''.join([' %d' % o.idx for o in option_nodes
+                                                if o.pattern.short == '-h' or o.pattern.long == '--help']) + ' '),
+      '"VERSION OPTION"': next((o.idx for o in option_nodes if o.pattern.long == '--version'), -1),
+      '      "OPTION LOOKUP"\n': indent(option_lookup([o.pattern for o in option_nodes]), level=3),
+      '  "NODES"': indent('\n'.join(map(str, list(nodes))), level=1),
+      '  "OUTPUT DEFAULTS"\n': indent(''.join(
+        default + '\n' for default in [node.output_default() for node in leaf_nodes] if default is not None)),
+      '  "OUTPUT DECLARATIONS"': indent(output_array_branch(
+        output, output_array(leaf_nodes, direct=False), output_declarations(leaf_nodes, prefix)), level=1),
+      '  "OUTPUT ASSIGNMENTS"': indent(output_array_branch(
+        output, output_array(leaf_nodes, direct=True), output_assignments(leaf_nodes, prefix)), level=1),
       '"INTERNAL VARNAMES"': ' \\\n    '.join(['var_%s' % node.variable_name for node in leaf_nodes]),
-      '"OUTPUT VARNAMES"': ' \\\n    '.join(['"${prefix}%s"' % node.variable_name for node in leaf_nodes]),
       '  "EARLY RETURN"\n': '' if leaf_nodes else '  return 0\n',
       '"MAX NODE IDX"': max([n.idx for n in doc_ast.nodes]),
       '"ROOT NODE IDX"': doc_ast.root_node.idx,
     }
-    main = self.library.functions['docopt'].replace_literal(replacements)
+    functions = ['docopt']
+    if script.invocation.parse_function:
+      functions.append('docopt_parse')
+    main = Code([shake(name, fold_settings(name, str(self.library.functions[name]), settings), features)
+                 for name in functions])
+    main = main.replace_literal(replacements)
+    if self.parameters.define_once:
+      main = Code(define_once(str(main)))
+    else:
+      main = main.replace_literal({'  "DEFINE ONCE"\n': '', '  "DEFINED"\n': ''})
     if self.parameters.minify:
-      main = main.minify(self.parameters.max_line_length)
+      # The parser functions and locals are only renamed when the library is part of the parser,
+      # the names that are derived from the usage are kept along with the output variables.
+      # docopt_parse() defines the functions in the calling shell, so they stay in the namespace
+      reserved = None
+      if not self.parameters.library_path:
+        reserved = set([name for node in leaf_nodes for name in [
+          node.variable_name, str(node.needle), node.pattern.name, output_name(node, prefix or '')]])
+      namespace = 'docopt__' if script.invocation.parse_function else ''
+      main = main.minify(self.parameters.max_line_length, reserved, namespace)
     return str(main)
 
+  def generate_posix(self, script):
+    # The POSIX sh parser of docopt_posix.sh. It has the node functions of `--codegen helpers`
+    # and outputs assignments for `eval "$(docopt "$@")"`, lists are strings of quoted words
+    if script.invocation.parse_function:
+      raise DocoptError('docopt_parse is not available with --target=posix, use `eval "$(docopt "$@")"`')
+    if next(option for option in script.options if option.name == 'DOCOPT_ARRAY').present:
+      raise DocoptError('DOCOPT_ARRAY is not available with --target=posix')
+    doc_ast = DocAst(script.doc.trimmed_value)
+    usage_start, usage_end = doc_ast.usage_match
+    leaf_nodes = [n for n in doc_ast.nodes if type(n) is LeafNode]
+    option_nodes = [node for node in leaf_nodes if type(node.pattern) is Option]
+    prefix = next(option.constant for option in script.options if option.name == 'DOCOPT_PREFIX')
+    # Branches are neither memoized nor dispatched on the first positional, those rely on bash
+    nodes = [node if type(node) is LeafNode else BranchNode(node.pattern, node.idx, doc_ast.node_map, dispatch=False)
+             for node in doc_ast.nodes]
+    helpers_needed = set([name for n in nodes for name in n.helper_names])
+    exclude = set(['docopt'] + helper_list) - helpers_needed
+    library = indent(str(Code([code for name, code in self.library.functions.items() if name not in exclude])), level=1)
+
+    replacements = {
+      '  "LIBRARY"': library,
+      '"OPTIONS COUNT"': len(option_nodes),
+      '  "OPTION METADATA"\n': indent(''.join([
+        'docopt_long_%d=%s docopt_argcount_%d=%d\n' % (o.idx, bash_ifs_value(o.pattern.long), o.idx, o.pattern.argcount)
+        for o in option_nodes])),
+      '"HELP OPTIONS"': bash_ifs_value(''.join([' %d' % o.idx for o in option_nodes
+                                                if o.pattern.short == '-h' or o.pattern.long == '--help']) + ' '),
+      '"VERSION OPTION"': next((o.idx for o in option_nodes if o.pattern.long == '--version'), -1),
+      '      "OPTION LOOKUP"\n': indent(option_lookup([o.pattern for o in option_nodes], posix=True), level=3),
+      '  "NODES"': indent('\n'.join(map(str, nodes))),
+      '  "OUTPUT DEFAULTS"\n': indent(''.join(
+        default + '\n' for default in [posix_output_default(node) for node in leaf_nodes] if default is not None)),
+      '  "OUTPUT DECLARATIONS"': indent(posix_output_declarations(leaf_nodes, prefix)),
+      '"INTERNAL VARNAMES"': ' \\\n    '.join(['var_%s' % node.variable_name for node in leaf_nodes]),
+      '  "EARLY RETURN"\n': '' if leaf_nodes else '  return 0\n',
+      '"ROOT NODE IDX"': doc_ast.root_node.idx,
+    }
+    main = Code(str(self.library.functions['docopt'])).replace_literal(replacements)
+    if self.parameters.minify:
+      reserved = set([name for node in leaf_nodes for name in [
+        node.variable_name, str(node.needle), node.pattern.name, output_name(node, prefix or '')]])
+      main = main.minify(self.parameters.max_line_length, reserved)
+    # The doc is inserted last, minify() would remove the indentation of its lines
+    return str(main.replace_literal({
+      '"DOC VALUE"': bash_ifs_value(script.doc.trimmed_value),
+      '"DOC USAGE"': bash_ifs_value(script.doc.trimmed_value[usage_start:usage_end]),
+    }))
+
+  def folded_settings(self, script):
+    # The DOCOPT_* settings that the parser is specialized for with --fold-settings,
+    # i.e. the ones that the script assigns a literal before invoking docopt.
+    # With --library the functions that check them are not generated
+    settings = OrderedDict([])
+    if not self.parameters.fold_settings or self.parameters.library_path:
+      return settings
+    for option in script.options:
+      if option.constant is None:
+        continue
+      if option.name == 'DOCOPT_PROGRAM_VERSION' or (option.constant in ['', 'true', 'false'] and option.name in [
+        'DOCOPT_ADD_HELP', 'DOCOPT_OPTIONS_FIRST', 'DOCOPT_DOC_CHECK'
+      ]):
+        settings[option.name] = option.constant
+    return settings
+
+
+def fold_settings(name, code, settings):
+  # Specializes the function `name` for the settings that are constant. Branches that
+  # only depend on a setting are replaced by their body or removed, conditions that test
+  # more than the setting are simplified. The lines are matched verbatim, a line that
+  # is not found in the function it belongs to is an error
+  enabled = {
+    'DOCOPT_ADD_HELP': settings.get('DOCOPT_ADD_HELP') != 'false',
+    'DOCOPT_OPTIONS_FIRST': settings.get('DOCOPT_OPTIONS_FIRST') == 'true',
+    'DOCOPT_DOC_CHECK': settings.get('DOCOPT_DOC_CHECK') != 'false',
+    'DOCOPT_PROGRAM_VERSION': settings.get('DOCOPT_PROGRAM_VERSION') not in ['', 'false'],
+  }
+  # All of the branches are in docopt__parse()
+  branches = {
+    'DOCOPT_ADD_HELP': ('if $help && ${DOCOPT_ADD_HELP:-true}; then', 'if $help; then'),
+    'DOCOPT_OPTIONS_FIRST': ('elif ${DOCOPT_OPTIONS_FIRST:-false}; then', None),
+    'DOCOPT_DOC_CHECK': ('if ${DOCOPT_DOC_CHECK:-true}; then', None),
+    'DOCOPT_PROGRAM_VERSION': (
+      'if $version && [[ ${DOCOPT_PROGRAM_VERSION:-false} != \'false\' ]]; then', 'if $version; then'
+    ),
+  }
+  # The lines of each function that only serve a branch which is removed when the setting is disabled
+  statements = {
+    'DOCOPT_ADD_HELP': {
+      'docopt': ['local help_options="HELP OPTIONS"'],
+      'docopt__parse_shorts': [
+        '[[ $short = -h ]] && help_options+="$match "',
+        '[[ $help_options = *" $match "* ]] && help=true',
+      ],
+      'docopt__parse_long': [
+        '[[ $long = --help ]] && help_options+="$match "',
+        '[[ $help_options = *" $match "* ]] && help=true',
+      ],
+    },
+    'DOCOPT_PROGRAM_VERSION': {
+      'docopt': ['local version_option="VERSION OPTION"'],
+      'docopt__parse_shorts': ['[[ $match = "$version_option" ]] && version=true'],
+      'docopt__parse_long': [
+        '[[ $long = --version ]] && version_option=$match',
+        '[[ $match = "$version_option" ]] && version=true',
+      ],
+    },
+  }
+  lines = code.split('\n')
+  for setting in settings.keys():
+    condition, simplified = branches[setting]
+    if name == 'docopt__parse':
+      if not enabled[setting]:
+        lines = fold_branch(lines, condition, False)
+      elif simplified is not None:
+        lines = replace_statement(lines, condition, simplified)
+      else:
+        lines = fold_branch(lines, condition, True)
+    if not enabled[setting]:
+      lines = remove_statements(lines, statements.get(setting, {}).get(name, []))
+  if name == 'docopt__parse' and 'DOCOPT_PROGRAM_VERSION' in settings and enabled['DOCOPT_PROGRAM_VERSION']:
+    lines = replace_statement(lines, 'docopt__stdout "$DOCOPT_PROGRAM_VERSION"', 'docopt__stdout %s' % bash_ifs_value(
+      settings['DOCOPT_PROGRAM_VERSION']))
+  return '\n'.join(lines)
+
+
+def replace_statement(lines, statement, replacement):
+  # Replaces the statement on every line it is on, it must be on at least one
+  if not any(statement in line for line in lines):
+    raise DocoptError('Unable to replace `%s`, it was not found' % statement)
+  return [line.replace(statement, replacement) for line in lines]
+
+
+def remove_statements(lines, statements):
+  # Removes the lines with only one of the statements, each of them must be found
+  missing = [statement for statement in statements if statement not in [line.strip() for line in lines]]
+  if missing:
+    raise DocoptError('Unable to remove `%s`, it was not found' % '`, `'.join(missing))
+  return [line for line in lines if line.strip() not in statements]
+
+
+def fold_branch(lines, condition, enabled):
+  # Replaces the if or elif branch with the condition by its body when it is enabled,
+  # removing the other branches, or removes the branch when it is disabled (leaving
+  # the body of the else branch of an if in its place)
+  for start, line in enumerate(lines):
+    if line.strip() == condition:
+      break
+  else:
+    raise DocoptError('Unable to fold `%s`, it was not found' % condition)
+  indentation = lines[start][:len(lines[start]) - len(lines[start].lstrip())]
+  ends = [idx for idx in range(start + 1, len(lines)) if lines[idx].startswith(indentation) and (
+    lines[idx][len(indentation):] in ['else', 'fi'] or lines[idx][len(indentation):].startswith('elif ')
+  )]
+  end = ends[0]
+  fi = next(idx for idx in ends if lines[idx] == indentation + 'fi')
+  if condition.startswith('elif '):
+    if enabled:
+      return lines[:start] + [indentation + 'else'] + lines[start + 1:end] + lines[fi:]
+    return lines[:start] + lines[end:]
+  if end != fi and lines[end] != indentation + 'else':
+    raise DocoptError('Unable to fold `%s`, it has more than one alternative branch' % condition)
+  # Continuation lines of strings are not indented
+  if enabled:
+    body = [line[2:] if line.startswith('  ') else line for line in lines[start + 1:end]]
+    return lines[:start] + body + lines[fi + 1:]
+  if end != fi:
+    body = [line[2:] if line.startswith('  ') else line for line in lines[end + 1:fi]]
+    return lines[:start] + body + lines[fi + 1:]
+  if end + 1 < len(lines) and lines[end + 1] == '' and lines[start - 1].endswith('{'):
+    end += 1
+  return lines[:start] + lines[end + 1:]
+
+
+def shake(name, code, features):
+  # Removes the code paths of the function `name` that are never taken by a parser with
+  # the features of DocAst.features, and the ones of the helpers that are left out.
+  # "direct" stands for docopt_parse() and "wsum" for a digest by checksum()
+  # The lines are matched verbatim, like the ones of fold_settings()
+  lines = code.split('\n')
+  leafs = {
+    'docopt__switch': ['flags'],
+    'docopt__value': ['option values', 'arguments'],
+    'docopt__command': ['commands'],
+  }
+  if name in leafs:
+    # only repeating leafs pass true in $3
+    if not any('repeated ' + leaf in features for leaf in leafs[name]):
+      lines = fold_branch(lines, 'if [[ $3 = true ]]; then', False)
+    elif not any(leaf in features for leaf in leafs[name]):
+      lines = fold_branch(lines, 'if [[ $3 = true ]]; then', True)
+  if name == 'docopt__value' and not {'arguments', 'repeated arguments'} & features:
+    lines = remove_statements(lines, ["[[ $idx = 'a' ]] && idx=${#shorts[@]}"])
+  # Unknown options are still registered, they have no argument unless given one with `--long=`
+  if name == 'docopt__parse_shorts' and 'short options' not in features:
+    lines = remove_statements(lines, ['docopt__lookup_option "$short" || return'])
+    lines = fold_branch(lines, 'if [[ $match = false ]]; then', True)
+  if name == 'docopt__parse_long' and 'long options' not in features:
+    lines = replace_statement(lines, 'docopt__lookup_option "$long" || return', 'match=false')
+    lines = fold_branch(lines, 'if [[ $match = false ]]; then', True)
+  if name == 'docopt__parse':
+    if 'wsum' in features:
+      lines = fold_branch(lines, 'if [[ $digest = wsum:* ]]; then', True)
+    if 'docopt__memoize' not in features:
+      lines = fold_branch(lines, 'if [[ ${BASH_VERSINFO[0]} -ge 4 ]]; then', False)
+    if 'docopt__stash' not in features:
+      lines = remove_statements(lines, [
+        '# consumed tokens of matches that are replayed later on, see docopt__stash()',
+        'local stash_journal=() stash_assignments=()',
+      ])
+  if name in ['docopt', 'docopt__stdout', 'docopt__stderr', 'docopt__return'] and 'direct' not in features:
+    lines = fold_branch(lines, 'if ${docopt_direct:-false}; then', False)
+    if name == 'docopt':
+      lines = replace_statement(lines, '${docopt_direct:-false} || set -e', 'set -e')
+      lines = replace_statement(lines, '${docopt_direct:-false} || unset', 'unset')
+      lines = remove_statements(lines, [
+        '# docopt_parse() runs in the calling shell, which must not exit on errors',
+        '# docopt_parse() assigns the variables itself, outside of the locals above',
+        '${docopt_direct:-false} && return 0',
+      ])
+  code = '\n'.join(lines)
+  if name == 'docopt' and not {'short options', 'long options'} & features:
+    code, count = re.subn(r'\n  # sets \$match to .*?\n  }\n', '\n', code, flags=re.DOTALL)
+    if count != 1:
+      raise DocoptError('Unable to remove docopt__lookup_option() from docopt(), it was not found')
+  return code
+
+
+def define_once(code):
+  # Wraps the function definitions of docopt() in a condition on a digest of them,
+  # so that they are skipped when the same parser has defined them before. That is
+  # only the case in the calling shell after docopt_parse() (or in the subshells of
+  # `eval "$(docopt "$@")"` that follow it), and not when another parser has
+  # redefined the functions in between
+  match = re.search(r'^  "DEFINE ONCE"\n(.*)^  "DEFINED"\n', code, re.MULTILINE | re.DOTALL)
+  digest = doc_checksum(match.group(1))
+  template = '{before}  if [[ ${{docopt_defined:-}} != {digest} ]]; then\n{definitions}\n' \
+             '    docopt_defined={digest}\n  fi\n{after}'
+  return template.format(
+    before=code[:match.start()],
+    digest=digest,
+    definitions=indent(match.group(1).rstrip('\n')),
+    after=code[match.end():],
+  )
+
+
+def output_name(node, prefix):
+  # The prefix is only known when DOCOPT_PREFIX is a constant in the script
+  if prefix is None:
+    return '"${docopt_prefix}%s"' % node.variable_name
+  return shlex.quote(prefix + node.variable_name)
+
+
+def output_declarations(leaf_nodes, prefix):
+  # Prints the declarations that the script evals, a single printf for all scalars
+  # and one `declare -a` for every list, instead of assigning the output variables
+  # and printing them with `declare -p`
+  scalars = [node for node in leaf_nodes if node.value_type != 'list']
+  lines = []
+  if scalars:
+    formats = ['%s=%q' if node.value_type == 'string' else '%s=%s' for node in scalars]
+    values = []
+    for node in scalars:
+      if node.value_type == 'string':
+        value = '"$var_%s"' % node.variable_name
+      else:
+        value = '"${var_%s:-%s}"' % (node.variable_name, node.default)
+      values.append('%s %s' % (output_name(node, prefix), value))
+    lines.append("printf -- 'declare -- %s\\n' \\\n  %s" % (' '.join(formats), ' \\\n  '.join(values)))
+  for node in leaf_nodes:
+    if node.value_type == 'list':
+      lines.append(
+        "printf -- 'declare -a %s=(' {name}\n"
+        "[[ ${{#var_{var}[@]}} -eq 0 ]] || printf -- '%q ' \"${{var_{var}[@]}}\"\n"
+        "printf -- ')\\n'".format(name=output_name(node, prefix), var=node.variable_name)
+      )
+  # The loop body must not be empty, even though docopt() returns early without variables
+  return '\n'.join(lines) or ':'
+
+
+def output_assignments(leaf_nodes, prefix):
+  # Assigns the output variables in docopt_parse(), after unsetting the ones
+  # that were inherited from the environment and may have a different type
+  if not leaf_nodes:
+    return ':'
+  return 'unset %s\n%s' % (
+    ' \\\n  '.join([output_name(node, prefix) for node in leaf_nodes]),
+    '\n'.join([node.output_assignment(prefix) for node in leaf_nodes]),
+  )
+
+
+def output_array(leaf_nodes, direct):
+  # Outputs all variables as a single array named $DOCOPT_ARRAY, with the keys that
+  # `docopts -A` uses. Lists are stored as their length in "NAME,#" and their items
+  # in "NAME,0", "NAME,1" etc. The array is associative starting with bash 4 (4.2 for
+  # docopt_parse(), which needs `declare -g`), in older versions the keys and values
+  # alternate in an indexed array
+  lines = ['local docopt_array docopt_format docopt_item docopt_idx']
+  if direct:
+    lines.extend(filter(None, [node.output_default() for node in leaf_nodes]))
+    lines.append(
+      'if [[ ${BASH_VERSINFO[0]} -gt 4 || ${BASH_VERSINFO[0]} -eq 4 && ${BASH_VERSINFO[1]} -ge 2 ]]; then\n'
+      '  docopt_array="unset $DOCOPT_ARRAY; declare -gA $DOCOPT_ARRAY=(" docopt_format=\' [%q]=%q\'\n'
+      'else\n'
+      '  docopt_array="unset $DOCOPT_ARRAY; $DOCOPT_ARRAY=(" docopt_format=\' %q %q\'\n'
+      'fi'
+    )
+  else:
+    lines.append(
+      'if [[ ${BASH_VERSINFO[0]} -ge 4 ]]; then\n'
+      '  docopt_array="declare -A $DOCOPT_ARRAY=(" docopt_format=\' [%q]=%q\'\n'
+      'else\n'
+      '  docopt_array="declare -a $DOCOPT_ARRAY=(" docopt_format=\' %q %q\'\n'
+      'fi'
+    )
+  items = []
+  for node in leaf_nodes:
+    if node.value_type == 'list':
+      items.append('%s "${#var_%s[@]}"' % (bash_ifs_value(node.pattern.name + ',#'), node.variable_name))
+    elif node.value_type == 'string':
+      items.append('%s "$var_%s"' % (bash_ifs_value(node.pattern.name), node.variable_name))
+    else:
+      items.append('%s "${var_%s:-%s}"' % (bash_ifs_value(node.pattern.name), node.variable_name, node.default))
+  if items:
+    lines.append('printf -v docopt_item "$docopt_format" \\\n  %s' % ' \\\n  '.join(items))
+    lines.append('docopt_array+=$docopt_item')
+  for node in leaf_nodes:
+    if node.value_type == 'list':
+      lines.append(
+        'for docopt_idx in "${{!var_{name}[@]}}"; do\n'
+        '  printf -v docopt_item "$docopt_format" {key}"$docopt_idx" "${{var_{name}[$docopt_idx]}}"\n'
+        '  docopt_array+=$docopt_item\n'
+        'done'.format(name=node.variable_name, key=bash_ifs_value(node.pattern.name + ',')))
+  lines.append('eval "$docopt_array )"' if direct else "printf -- '%s )\\n' \"$docopt_array\"")
+  return '\n'.join(lines)
+
+
+def posix_output_default(node):
+  # LeafNode.output_default() for --target=posix, where lists are strings of quoted words
+  name = 'var_' + node.variable_name
+  if node.value_type == 'list' and node.pattern.value:
+    # the words are quoted like quote() does, which always uses single quotes
+    words = ' '.join("'%s'" % str(value).replace("'", "'\\''") for value in node.pattern.value)
+    return '[ -n "${{{name}:-}}" ] || {name}={default}'.format(name=name, default=bash_ifs_value(words))
+  return node.output_default() if node.value_type == 'string' else None
+
+
+def posix_output_declarations(leaf_nodes, prefix):
+  # Prints the assignments that the script evals for --target=posix, every string and
+  # list is single quoted with quote(), bools & counts are printed with a single printf
+  scalars = [node for node in leaf_nodes if node.value_type in ['bool', 'count']]
+  lines = []
+  if scalars:
+    lines.append("printf -- '%s=%s\\n' \\\n  {values}".format(values=' \\\n  '.join([
+      '%s "${var_%s:-%s}"' % (output_name(node, prefix), node.variable_name, node.default) for node in scalars])))
+  for node in leaf_nodes:
+    if node.value_type in ['string', 'list']:
+      lines.append('docopt__quote "${{var_{var}:-}}"\nprintf -- \'%s=%s\\n\' {name} "$quoted"'.format(
+        var=node.variable_name, name=output_name(node, prefix)))
+  return '\n'.join(lines) or ':'
+
+
+def output_array_branch(output, array_code, variables_code):
+  # Selects between the array and the separate variables at runtime when
+  # DOCOPT_ARRAY is not a constant in the script
+  if output == 'both':
+    return 'if [[ -n ${DOCOPT_ARRAY:-} ]]; then\n%s\nelse\n%s\nfi' % (indent(array_code), indent(variables_code))
+  return array_code if output == 'array' else variables_code
+
+
+def option_lookup(options, posix=False):
+  # case branches that map option names and abbreviations to their index in shorts/longs
+  names = OrderedDict([])
+  for idx, option in enumerate(options):
+    for name in [option.short, option.long]:
+      if name is not None:
+        names.setdefault(name, []).append(idx)
+  patterns = OrderedDict([])
+  branches = []
+  for name, indexes in names.items():
+    if len(indexes) == 1:
+      patterns.setdefault(indexes[0], []).append(bash_ifs_value(name))
+    elif name.startswith('--'):
+      branches.append('%s) docopt__error %s;;' % (bash_ifs_value(name), bash_ifs_value(
+        '%s is not a unique prefix: %s?' % (name, ' '.join([name] * len(indexes))))))
+    else:
+      branches.append('%s) docopt__error %s;;' % (bash_ifs_value(name), bash_ifs_value(
+        '%s is specified ambiguously %d times' % (name, len(indexes)))))
+  branches = ['%s) match=%d;;' % ('|'.join(names), idx) for idx, names in patterns.items()] + branches
+  # Abbreviations of long options are matched by their shortest unique prefix,
+  # tokens that are ambiguous or unknown fall through to the loop in parse_long
+  longs = [name for name in names.keys() if name.startswith('--')]
+  for name in longs:
+    if len(names[name]) > 1:
+      continue
+    for length in range(3, len(name)):
+      prefix = name[:length]
+      if not any(other.startswith(prefix) for other in longs if other != name):
+        if posix:
+          template = '{prefix}*) case {name} in "$1"*) match={idx};; *) match=false;; esac;;'
+        else:
+          template = '{prefix}*) [[ {name} = "$1"* ]] && match={idx} || match=false;;'
+        branches.append(template.format(prefix=bash_ifs_value(prefix), name=bash_ifs_value(name), idx=names[name][0]))
+        break
+  return ''.join(branch + '\n' for branch in branches)
+
+
+def lazy_nodes(doc_ast):
+  # The nodes that only one alternative of the Either at the root refers to are
+  # defined by that alternative when it is tried, the other ones right away
+  either = doc_ast.root_node.pattern
+  while type(either) is Required and len(either.children) == 1:
+    either = either.children[0]
+  if type(either) is not Either:
+    return list(doc_ast.nodes)
+  owners = {}
+  for alternative in either.children:
+    for pattern in iter(alternative):
+      owners.setdefault(pattern, set()).add(alternative)
+  lazy = OrderedDict([(alternative, []) for alternative in either.children])
+  eager = []
+  for pattern, node in doc_ast.node_map.items():
+    if len(owners.get(pattern, [])) == 1:
+      lazy[next(iter(owners[pattern]))].append(node)
+    else:
+      eager.append(node)
+  # an alternative that occurs in another one is defined right away along with its children
+  return eager + [LazyNode(doc_ast.node_map[alternative], nodes) for alternative, nodes in lazy.items() if nodes]
+
 
 class Library(object):
 
-  def __init__(self):
+  def __init__(self, target='bash'):
     function_re = re.compile((
         r'^(?P<name>[a-z_][a-z0-9_]*)\(\)\s*\{'
         r'\n+'
@@ -91,15 +581,30 @@ class Library(object):
         r'\n+\}\n$'
       ), re.MULTILINE | re.IGNORECASE | re.DOTALL)
     self.functions = OrderedDict([])
-    with open(os.path.join(os.path.dirname(__file__), 'docopt.sh'), 'r') as handle:
+    # The function that marks the library as loaded, named after its version
+    self.sentinel = 'docopt_lib_' + re.sub(r'\W', '_', __version__)
+    # The POSIX sh functions of --target posix are a template of their own
+    template = 'docopt_posix.sh' if target == 'posix' else 'docopt.sh'
+    with open(os.path.join(os.path.dirname(__file__), template), 'r') as handle:
       for match in function_re.finditer(handle.read()):
         name = match.group('name')
         if name == 'lib_version_check':
           self.functions['lib_version_check'] = Code(match.group('body')).replace_literal(
             {'"LIBRARY VERSION"': __version__}
           )
+        elif name == 'lib_sentinel':
+          self.functions['lib_sentinel'] = match.group('body')
         else:
           self.functions[match.group('name')] = Code(match.group(0))
+    if 'lib_sentinel' not in self.functions:
+      return
+    exported = [name for name in self.functions.keys() if name not in [
+      'docopt', 'docopt_parse', 'lib_version_check', 'lib_sentinel'
+    ]] + [self.sentinel]
+    self.functions['lib_sentinel'] = Code(self.functions['lib_sentinel']).replace_literal({
+      '"LIBRARY SENTINEL"': self.sentinel,
+      '"LIBRARY FUNCTIONS"': ' \\\n    '.join(exported),
+    })
 
   def generate_code(self, exclude=[]):
     return Code([code for name, code in self.functions.items() if name not in exclude])
@@ -112,8 +617,9 @@ class ParserParameter(object):
       script_value = None
     else:
       script_value = script_params[name]
-    defined_in_invocation = invocation_params[name] is not None
-    defined_in_script = script_value is not None
+    # Flags that are not specified are False rather than None
+    defined_in_invocation = invocation_params[name] not in [None, False]
+    defined_in_script = script_value not in [None, False]
     auto_params = not invocation_params['--no-auto-params']
 
     self.name = name
@@ -125,6 +631,8 @@ class ParserParameter(object):
     self.changed = script_params is not None and self.value != self.script_value
 
   def __str__(self):
+    if self.value is True:
+      return self.name
     return '%s=%s' % (self.name, shlex.quote(self.value))
 
 
@@ -145,6 +653,10 @@ class ParserParameters(object):
     params = OrderedDict([])
     params['--line-length'] = ParserParameter('--line-length', invocation_params, script_params, default='80')
     params['--library'] = ParserParameter('--library', invocation_params, script_params, default=None)
+    params['--codegen'] = ParserParameter('--codegen', invocation_params, script_params, default='auto')
+    params['--fold-settings'] = ParserParameter('--fold-settings', invocation_params, script_params, default=False)
+    params['--define-once'] = ParserParameter('--define-once', invocation_params, script_params, default=False)
+    params['--target'] = ParserParameter('--target', invocation_params, script_params, default='bash')
 
     merged_from_script = list(filter(lambda p: p.merged_from_script, params.values()))
     if merged_from_script:
@@ -157,6 +669,21 @@ class ParserParameters(object):
     self.max_line_length = int(params['--line-length'].value)
     self.library_path = params['--library'].value
     self.minify = self.max_line_length > 0
+    self.codegen = params['--codegen'].value
+    self.fold_settings = params['--fold-settings'].value
+    self.define_once = params['--define-once'].value
+    if self.codegen not in ['auto', 'helpers', 'inline', 'lazy']:
+      raise DocoptError('--codegen must be `auto`, `helpers`, `inline` or `lazy`, not `%s`' % self.codegen)
+    self.target = params['--target'].value
+    if self.target not in ['bash', 'posix']:
+      raise DocoptError('--target must be `bash` or `posix`, not `%s`' % self.target)
+    if self.target == 'posix':
+      # The POSIX sh parser only has the helpers, the other code paths rely on bash
+      unsupported = [name for name in ['--library', '--fold-settings', '--define-once'] if params[name].value]
+      if self.codegen not in ['auto', 'helpers']:
+        unsupported.append('--codegen=%s' % self.codegen)
+      if unsupported:
+        raise DocoptError('--target=posix can not be combined with %s' % ', '.join(unsupported))
 
     command = ['docopt.sh']
     command_short = ['docopt.sh']
@@ -164,6 +691,14 @@ class ParserParameters(object):
       command.append(str(params['--line-length']))
     if params['--library'].defined:
       command.append(str(params['--library']))
+    if params['--codegen'].defined:
+      command.append(str(params['--codegen']))
+    if params['--fold-settings'].defined:
+      command.append(str(params['--fold-settings']))
+    if params['--define-once'].defined:
+      command.append(str(params['--define-once']))
+    if params['--target'].defined:
+      command.append(str(params['--target']))
     if script is not None and script.path:
       command.append(os.path.basename(script.path))
       command_short.append(os.path.basename(script.path))
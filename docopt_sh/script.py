@@ -19,7 +19,7 @@ class Script(object):
     self.invocation = Invocation(self, self.guards)
     self.options = [Option(self, name) for name in [
       'DOCOPT_ADD_HELP', 'DOCOPT_PROGRAM_VERSION', 'DOCOPT_OPTIONS_FIRST',
-      'DOCOPT_PREFIX', 'DOCOPT_DOC_CHECK', 'DOCOPT_LIB_CHECK'
+      'DOCOPT_PREFIX', 'DOCOPT_DOC_CHECK', 'DOCOPT_LIB_CHECK', 'DOCOPT_ARRAY', 'DOCOPT_LIB_EXPORT'
     ]]
 
   def validate(self):
@@ -60,14 +60,14 @@ class Script(object):
     if not self.invocation.present:
       log.warning(
         '%s No invocations of docopt found, check your script to make sure this is correct.\n'
-        'docopt.sh is invoked with `eval "$(docopt "$@")"`.',
+        'docopt.sh is invoked with `eval "$(docopt "$@")"` or `docopt_parse "$@"`.',
         self.invocation
       )
     for option in self.options:
       if self.invocation.present and option.present and option.start > self.invocation.last.end:
         log.warning(
           '%s $%s has no effect when specified after invoking docopt, '
-          'make sure to place docopt options before calling `eval "$(docopt "$@")"`.',
+          'make sure to place docopt options before invoking docopt.',
           option, option.name
         )
 
@@ -77,7 +77,10 @@ class Script(object):
         start=self.contents[:self.guards.start],
         guard_begin=(
           "# docopt parser below, refresh this parser with `%s`"
-          % parser.parameters.refresh_command_short),
+          % parser.parameters.refresh_command_short) + ''.join(
+          ", folded %s" % ' '.join('%s=%s' % (name, shlex.quote(value)) for name, value in settings.items())
+          for settings in [parser.folded_settings(self)] if settings
+        ),
         shellcheck_ignores='# shellcheck disable=%s' % ','.join(parser.shellcheck_ignores),
         parser=parser.generate(self),
         guard_end=(
@@ -221,20 +224,36 @@ class Guards(object):
 class Invocation(ScriptLocation):
 
   def __init__(self, script, parser):
-    matches = re.finditer(r'eval "\$\(docopt\s+"\$\@"\)"', script.contents[parser.end:])
+    matches = re.finditer(
+      r'eval "\$\(docopt\s+"\$\@"\)"|\bdocopt_parse\s+"\$\@"',
+      script.contents[parser.end:]
+    )
     super(Invocation, self).__init__(script, matches, parser.end)
+    # docopt_parse() is only added to the parser when the script calls it
+    self.parse_function = any(match.group(0).startswith('docopt_parse') for match in self.matches)
 
 
 class Option(ScriptLocation):
 
   def __init__(self, script, name):
     self.name = name
-    matches = re.finditer(r'^%s=' % name, script.contents, re.MULTILINE)
+    matches = re.finditer(
+      r'^%s=(?:\'(?P<single_quoted>[^\']*)\'|"(?P<double_quoted>[^"$`\\]*)"|(?P<unquoted>[^\s;&|<>()$`\\\'"]*))'
+      r'(?P<end>\s*(?:[;#]|$))?' % name,
+      script.contents, re.MULTILINE
+    )
     super(Option, self).__init__(script, matches, 0)
     if self.count > 1:
       # Override parent class selection of first match, previous assignments
       # would be overwritten so it's the last match that has an effect
       self.match = self.matches[-1]
+    # The value when the option is assigned a literal exactly once before docopt is invoked
+    self.constant = None
+    if self.count == 1 and self.match.group('end') is not None and (
+      not script.invocation.present or self.start < script.invocation.start
+    ):
+      self.constant = next(value for value in self.match.group('single_quoted', 'double_quoted', 'unquoted')
+                           if value is not None)
 
 
 class DocoptScriptValidationError(DocoptError):
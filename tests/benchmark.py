@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Measures how long generated parsers take to parse their arguments
+Usage:
+  benchmark.py argv [options] [SIZE...]
+  benchmark.py codegen [options]
+
+Options:
+  --bash PATH      The bash executable to run the parsers with [default: bash]
+  --runs N         Number of runs per measurement, the fastest is reported [default: 3]
+  --tokenize-only  Only let the usage match a few tokens, so that parsing
+                   fails right after the tokenizer has run
+  --repeat N       Number of parses per run for `codegen` [default: 200]
+
+argv:
+  Parses SIZE arguments (default: 1000 2000 4000 8000) consisting of
+  clustered shorts, long options with and without `=`, and positionals.
+
+codegen:
+  Compares the size of the parsers and the time they take to parse a
+  command line for the `--codegen` modes. Uses tests/scripts/naval_fate.sh
+  and a synthetic usage with many commands and options.
+"""
+
+import os
+import sys
+import subprocess
+import docopt
+from itertools import cycle
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from docopt_sh.__main__ import __doc__ as docopt_sh_doc  # noqa: E402
+from docopt_sh.parser import Parser, ParserParameters  # noqa: E402
+from docopt_sh.script import Script  # noqa: E402
+
+
+def generate(doc, *params):
+  script = Script('DOC="%s"\neval "$(docopt "$@")"\n' % doc)
+  parser = Parser(ParserParameters(docopt.docopt(docopt_sh_doc, list(params) + ['-']), script))
+  return 'DOC="{doc}"\n{parser}'.format(doc=doc, parser=parser.generate(script))
+
+
+def measure(bash, parser, argv, runs, repeat=1):
+  # The time is measured by bash itself to leave out startup and parser definition
+  program = parser + (
+    'TIMEFORMAT=%3R\ntime for ((run=0; run<{repeat}; run++)); do docopt_output=$(docopt "$@" 2>/dev/null); done\n'
+  ).format(repeat=repeat)
+  timings = []
+  for _ in range(runs):
+    process = subprocess.run(
+      [bash, '-c', program, 'benchmark'] + argv,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    timings.append(float(process.stderr.decode('utf-8').strip().split('\n')[-1]))
+  return min(timings)
+
+
+def benchmark_argv(bash, sizes, runs, tokenize_only):
+  if tokenize_only:
+    doc = 'Usage: prog [-v] [-n <name>] [--file=<path>] [<arg>]'
+  else:
+    doc = 'Usage: prog [-v...] [-n <name>...] [--file=<path>...] [<arg>...]'
+  parser = generate(doc)
+  tokens = [['-vn', 'name'], ['--file=a'], ['--file', 'b'], ['arg']]
+  print('%8s %10s %14s' % ('tokens', 'seconds', 'usec/token'))
+  for size in sizes:
+    argv = []
+    for group in cycle(tokens):
+      if len(argv) >= size:
+        break
+      argv.extend(group)
+    seconds = measure(bash, parser, argv, runs)
+    print('%8d %10.3f %14.1f' % (len(argv), seconds, seconds * 1000000 / len(argv)))
+
+
+def synthetic_doc(size):
+  commands = ['  prog cmd%d [options] <file>...' % i for i in range(size)]
+  options = ['  --opt-%d=<value>  Option %d.' % (i, i) for i in range(size)]
+  return 'Usage:\n%s\n\nOptions:\n  -v  Verbose.\n%s\n' % ('\n'.join(commands), '\n'.join(options))
+
+
+def benchmark_codegen(bash, runs, repeat):
+  with open(os.path.join(os.path.dirname(__file__), 'scripts/naval_fate.sh'), 'r') as handle:
+    naval_fate = Script(handle.read()).doc.untrimmed_value
+  usages = [
+    ('naval_fate.sh', naval_fate, ['ship', 'Guardian', 'move', '10', '50', '--speed=20']),
+    ('synthetic', synthetic_doc(40), ['cmd39', '-v', 'a', '--opt-20=x', 'b', '--opt-39', 'y']),
+  ]
+  print('%-14s %-8s %8s %14s' % ('usage', 'codegen', 'bytes', 'msec/parse'))
+  for name, doc, argv in usages:
+    for codegen in ['auto', 'helpers', 'inline', 'lazy']:
+      parser = generate(doc, '--codegen', codegen)
+      seconds = measure(bash, parser, argv, runs, repeat)
+      print('%-14s %-8s %8d %14.3f' % (name, codegen, len(parser) - len(doc), seconds * 1000 / repeat))
+
+
+if __name__ == '__main__':
+  params = docopt.docopt(__doc__)
+  if params['argv']:
+    sizes = list(map(int, params['SIZE'])) or [1000, 2000, 4000, 8000]
+    benchmark_argv(params['--bash'], sizes, int(params['--runs']), params['--tokenize-only'])
+  if params['codegen']:
+    benchmark_codegen(params['--bash'], int(params['--runs']), int(params['--repeat']))
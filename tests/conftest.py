@@ -4,6 +4,7 @@ import subprocess
 import re
 import glob
 import json
+import shutil
 from . import Usecase
 
 log = logging.getLogger(__name__)
@@ -14,6 +15,10 @@ def pytest_addoption(parser):
     '--bash-version', type=str,
     help='test with specific bash version (comma separated, or "all" for all installed versions)'
   )
+  parser.addoption(
+    '--posix-shell', type=str, default='dash',
+    help='the POSIX sh to test parsers generated with --target=posix with (default: dash, skipped if missing)'
+  )
 
 
 def pytest_sessionstart(session):
@@ -35,6 +40,10 @@ def pytest_generate_tests(metafunc):
   if 'bash' in metafunc.fixturenames:
     if metafunc.config.bash_versions:
       metafunc.parametrize('bash', metafunc.config.bash_versions)
+  if 'posix_shell' in metafunc.fixturenames:
+    shell = metafunc.config.getoption('--posix-shell')
+    executable = shutil.which(shell)
+    metafunc.parametrize('posix_shell', [(shell, executable)] if executable else [])
   if 'usecase' in metafunc.fixturenames:
     with open(os.path.join(os.path.dirname(__file__), 'usecases.txt'), 'r') as handle:
       contents = handle.read()
@@ -63,7 +72,7 @@ def pytest_assertrepr_compare(config, op, left, right):
 
 
 def parse_usecases(raw):
-  fixture_pattern = re.compile(r'r"""(?P<doc>[^"]+)""".*?(?=r""")', re.DOTALL)
+  fixture_pattern = re.compile(r'r"""(?P<doc>[^"]+)""".*?(?=r"""|\Z)', re.DOTALL)
   case_pattern = re.compile(
     r'\$ (?P<prog>[^\n ]+)( (?P<argv>[^\n]+))?\n(?P<expect>[^\n]+?)(?P<comment>\s*#[^\n]*)?\n\n')
   for fixture_match in fixture_pattern.finditer(raw):
@@ -0,0 +1,22 @@
+#!/usr/bin/env bash
+
+DOC="Usage: parse_function.sh ship new <name>...
+"
+"DOCOPT PARAMS"
+# a function and a variable named like the ones of the parser
+error() { echo "The script's error()"; }
+var__name_=script
+functions=$(declare -F | grep -v ' docopt')
+docopt_parse "$@" || exit "$docopt_status"
+
+if $ship && $new; then
+  echo "${_name_[@]}"
+fi
+if declare -p shorts parsed_params >/dev/null 2>&1; then
+  echo "The parser state leaked"
+fi
+if [[ $(declare -F | grep -v ' docopt') != "$functions" ]]; then
+  echo "The parser defined functions outside of its namespace"
+fi
+error
+echo "$var__name_"
@@ -0,0 +1,11 @@
+#!/bin/sh
+
+DOC="Usage: posix_ship_name.sh ship new <name>...
+"
+"DOCOPT PARAMS"
+eval "$(docopt "$@")"
+
+if $ship && $new; then
+  eval "set -- $_name_"
+  echo "$# ships: $*"
+fi
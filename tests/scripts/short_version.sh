@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+
+DOC="Usage: short_version.sh [-q] [-V]
+
+Options:
+  -q            Quiet.
+  -V --version  Show version.
+"
+"DOCOPT PARAMS"
+eval "$(docopt "$@")"
+
+$_q || echo "not quiet"
@@ -1,6 +1,10 @@
 import re
 import os
+import pytest
 from io import StringIO
+from tempfile import NamedTemporaryFile
+from docopt_sh import DocoptError
+from docopt_sh.parser import Library, fold_settings, shake
 from . import bash_eval_script, patch_file, invoke_docopt, temp_file, generated_library
 
 
@@ -27,6 +31,21 @@ def test_help(monkeypatch, capsys, bash):
   assert out == 'Usage: echo_ship_name.sh ship new <name>...\n'
 
 
+def test_help_declared_option(monkeypatch, capsys, bash):
+  run = patch_file(
+    monkeypatch, capsys, 'naval_fate.sh',
+    docopt_params={'DOCOPT_PROGRAM_VERSION': '0.1.5'}
+  )
+  code, out, err = run(bash, 'ship', 'new', 'Britannica', '--vers', '--he')
+  assert err == ''
+  assert code == 0
+  assert out.startswith('Naval Fate.\n')
+  code, out, err = run(bash, 'ship', 'new', 'Britannica', '--version')
+  assert err == ''
+  assert code == 0
+  assert out == '0.1.5\n'
+
+
 def test_no_help(monkeypatch, capsys, bash):
   run = patch_file(
     monkeypatch, capsys, 'echo_ship_name.sh',
@@ -60,6 +79,18 @@ def test_no_version(monkeypatch, capsys, bash):
   assert out == ''
 
 
+@pytest.mark.parametrize('args', [['-V'], ['-qV'], ['--version']])
+def test_short_version(monkeypatch, capsys, bash, args):
+  run = patch_file(
+    monkeypatch, capsys, 'short_version.sh',
+    docopt_params={'DOCOPT_PROGRAM_VERSION': '1.0'}
+  )
+  code, out, err = run(bash, *args)
+  assert err == ''
+  assert code == 0
+  assert out == '1.0\n'
+
+
 def test_options_anywhere(monkeypatch, capsys, bash):
   run = patch_file(monkeypatch, capsys, 'naval_fate.sh')
   code, out, err = run(bash, 'ship', 'Titanic', 'move', '1', '--speed', '6', '4')
@@ -99,6 +130,186 @@ def test_prefix(monkeypatch, capsys, bash):
   assert out == 'Titanic\n'
 
 
+def test_prefix_not_constant(monkeypatch, capsys, bash):
+  script = StringIO('''
+DOC="Usage: prefixed_echo.sh ship new <name>... [--speed=<kn>]"
+prefix=prefix_
+DOCOPT_PREFIX=$prefix
+eval "$(docopt "$@")"
+echo "$prefix__name_" "$prefix___speed"
+declare -p prefix__name_
+''')
+  captured = invoke_docopt(monkeypatch, capsys, program_params=['-'], stdin=script)
+  assert '${docopt_prefix}' in captured.out
+  code, out, err = bash_eval_script(bash, captured.out, ['ship', 'new', 'Titanic', "it's", '--speed=5'])
+  assert err == ''
+  assert code == 0
+  assert out == 'Titanic 5\ndeclare -a prefix__name_=([0]="Titanic" [1]="it\'s")\n'
+
+
+def test_prefix_constant(monkeypatch, capsys):
+  script = StringIO('''
+DOC="Usage: prefixed_echo.sh ship new <name>..."
+DOCOPT_PREFIX=prefix_
+eval "$(docopt "$@")"
+''')
+  captured = invoke_docopt(monkeypatch, capsys, program_params=['-'], stdin=script)
+  assert '${docopt_prefix}' not in captured.out
+  assert 'prefix__name_' in captured.out
+
+
+def test_fold_settings(monkeypatch, bash):
+  docopt_params = {
+    'DOCOPT_ADD_HELP': False, 'DOCOPT_PROGRAM_VERSION': '1.0 beta',
+    'DOCOPT_OPTIONS_FIRST': True, 'DOCOPT_DOC_CHECK': False
+  }
+  with temp_file('naval_fate.sh', docopt_params=docopt_params) as (script, run):
+    invoke_docopt(monkeypatch, program_params=['--fold-settings', script.name])
+    with open(script.name, 'r') as h:
+      contents = h.read()
+    assert (
+      ", folded DOCOPT_ADD_HELP=false DOCOPT_PROGRAM_VERSION='1.0 beta' "
+      "DOCOPT_OPTIONS_FIRST=true DOCOPT_DOC_CHECK=false\n" in contents
+    )
+    parser = contents[contents.index('# docopt parser below'):contents.index('# docopt parser above')]
+    for name in docopt_params.keys():
+      assert name not in parser.split('\n', 1)[1]
+    assert 'checksum' not in parser
+    code, out, err = run(bash, 'ship', 'new', 'Britannica', '--help')
+    assert code == 0
+    assert out == "Your new ship 'Britannica' has been created.\n"
+    code, out, err = run(bash, '--version')
+    assert code == 0
+    assert out == '1.0 beta\n'
+    code, out, err = run(bash, 'ship', 'Titanic', 'move', '1', '4', '--speed', '6')
+    assert code == 1
+    assert err.startswith('Usage:')
+
+
+@pytest.mark.parametrize('args', [['-V'], ['-qV']])
+def test_fold_settings_short_version(monkeypatch, bash, args):
+  with temp_file('short_version.sh', docopt_params={'DOCOPT_PROGRAM_VERSION': '1.0'}) as (script, run):
+    invoke_docopt(monkeypatch, program_params=['--fold-settings', script.name])
+    code, out, err = run(bash, *args)
+    assert code == 0
+    assert out == '1.0\n'
+
+
+def test_fold_settings_defaults(monkeypatch, bash):
+  docopt_params = {'DOCOPT_ADD_HELP': True, 'DOCOPT_PROGRAM_VERSION': False, 'DOCOPT_DOC_CHECK': True}
+  with temp_file('naval_fate.sh', docopt_params=docopt_params) as (script, run):
+    invoke_docopt(monkeypatch, program_params=['--fold-settings', script.name])
+    code, out, err = run(bash, '--help')
+    assert code == 0
+    assert out.startswith('Naval Fate.\n')
+    # --version is declared in the doc and no longer handled by the parser
+    code, out, err = run(bash, '--version')
+    assert code == 0
+    assert out == ''
+    with open(script.name, 'r') as h:
+      contents = h.read()
+    with open(script.name, 'w') as h:
+      h.write(contents.replace('ship new <name>', 'ship add <name>'))
+    code, out, err = run(bash, 'ship', 'new', 'Olympia')
+    assert code == 70
+
+
+@pytest.mark.parametrize('value', ['true', 'false'])
+def test_fold_settings_template(value):
+  # The lines that are folded are matched verbatim, every one of them must be in the template
+  settings = {
+    'DOCOPT_ADD_HELP': value, 'DOCOPT_OPTIONS_FIRST': value,
+    'DOCOPT_DOC_CHECK': value, 'DOCOPT_PROGRAM_VERSION': '1.0' if value == 'true' else value,
+  }
+  for name, code in Library().functions.items():
+    fold_settings(name, str(code), settings)
+  with pytest.raises(DocoptError):
+    fold_settings('docopt__parse', 'docopt__parse() {\n  :\n}', {'DOCOPT_DOC_CHECK': 'false'})
+
+
+def test_shake_template():
+  # Without any features every code path that shake() removes is taken out of the template
+  for name, code in Library().functions.items():
+    shake(name, str(code), set())
+  with pytest.raises(DocoptError):
+    shake('docopt__parse_long', 'docopt__parse_long() {\n  :\n}', set())
+
+
+def test_array(monkeypatch, capsys, bash):
+  script = StringIO('''
+DOC="Usage: prog [-v...] [--speed=<kn>] [--name=<n>] go FILE...
+Options:
+  --speed=<kn>  Speed [default: 10]
+"
+DOCOPT_ARRAY=ARGS
+eval "$(docopt "$@")"
+if [[ ${BASH_VERSINFO[0]} -lt 4 ]]; then
+  printf '%s=%s\\n' "${ARGS[@]}" | LC_ALL=C sort
+  exit
+fi
+for key in -v --speed --name go 'FILE,#' 'FILE,0' 'FILE,1'; do
+  printf '%s=%s\\n' "$key" "${ARGS[$key]}"
+done | LC_ALL=C sort
+''')
+  captured = invoke_docopt(monkeypatch, capsys, program_params=['-'], stdin=script)
+  assert 'declare -p' not in captured.out
+  code, out, err = bash_eval_script(bash, captured.out, ['-vv', 'go', 'a', "it's"])
+  assert err == ''
+  assert code == 0
+  assert out == "--name=\n--speed=10\n-v=2\nFILE,#=2\nFILE,0=a\nFILE,1=it's\ngo=true\n"
+
+
+def test_array_not_constant(monkeypatch, capsys, bash):
+  script = StringIO('''
+DOC="Usage: prog [--name=<n>]"
+DOCOPT_ARRAY=$1
+shift
+docopt_parse "$@" || exit "$docopt_status"
+declare -p ${DOCOPT_ARRAY:-__name} | sed 's/^declare -[aA-]* //'
+''')
+  captured = invoke_docopt(monkeypatch, capsys, program_params=['-'], stdin=script)
+  code, out, err = bash_eval_script(bash, captured.out, ['', '--name=x'])
+  assert err == ''
+  assert code == 0
+  assert out == '__name="x"\n'
+  code, out, err = bash_eval_script(bash, captured.out, ['ARGS', '--name=x'])
+  assert err == ''
+  assert code == 0
+  if bash[0] < '4' or bash[0] == '4' and bash[2] < '2':
+    assert out == 'ARGS=([0]="--name" [1]="x")\n'
+  else:
+    assert out == 'ARGS=([--name]="x" )\n'
+
+
+def test_define_once(monkeypatch, capsys, bash):
+  script = '''
+DOC="Usage: prog [--name=<n>]"
+f() {
+  docopt_parse "$@" || exit "$docopt_status"
+  echo "$__name"
+}
+f --name=a
+# Count the calls of docopt__parse (not renamed without minifying), unless docopt() defines it again
+parse_calls=0
+eval "original_$(declare -f docopt__parse)"
+docopt__parse() { ((++parse_calls)); original_docopt__parse "$@"; }
+f --name=b
+echo "$parse_calls"
+'''
+  captured = invoke_docopt(monkeypatch, capsys, program_params=['--line-length', '0', '-'], stdin=StringIO(script))
+  code, out, err = bash_eval_script(bash, captured.out, [])
+  assert err == ''
+  assert code == 0
+  assert out == 'a\nb\n0\n'
+  captured = invoke_docopt(
+    monkeypatch, capsys, program_params=['--define-once', '--line-length', '0', '-'], stdin=StringIO(script))
+  assert '--define-once' in captured.out
+  code, out, err = bash_eval_script(bash, captured.out, [])
+  assert err == ''
+  assert code == 0
+  assert out == 'a\nb\n1\n'
+
+
 def test_patch_file(monkeypatch, bash):
   with temp_file('echo_ship_name.sh') as (script, run):
     invoke_docopt(monkeypatch, program_params=[script.name])
@@ -124,6 +335,19 @@ def test_doc_check(monkeypatch, bash):
     assert re.match(regex, err) is not None
 
 
+def test_doc_check_same_length(monkeypatch, bash):
+  with temp_file('echo_ship_name.sh') as (script, run):
+    invoke_docopt(monkeypatch, program_params=[script.name])
+    with open(script.name, 'r') as h:
+      contents = h.read()
+    contents = contents.replace('ship new <name>', 'ship wen <name>')
+    with open(script.name, 'w') as h:
+      h.write(contents)
+    code, out, err = run(bash, 'ship', 'wen', 'Olympia')
+    assert re.match(r'^The current usage doc \(wsum:[0-9a-f]{8}\) does not match', err) is not None
+    assert code == 70
+
+
 def test_no_doc_check(monkeypatch, bash):
   with temp_file('echo_ship_name.sh', docopt_params={'DOCOPT_DOC_CHECK': False}) as (script, run):
     invoke_docopt(monkeypatch, program_params=[script.name])
@@ -160,6 +384,54 @@ fi
   assert out == 'Argo\n'
 
 
+def test_unused_features(monkeypatch, capsys, bash):
+  doc = 'Usage: echo_ship_name.sh ship new <name>...'
+  script = '''
+DOC="{doc}"
+eval "$(docopt "$@")"
+'''.format(doc=doc)
+  parser = invoke_docopt(monkeypatch, capsys=capsys, program_params=['--parser', '-'], stdin=StringIO(script)).out
+  # no options, no counted commands, no single arguments and no docopt_parse()
+  for code in ['lookup_option', '((var_$1++))', 'var_$1=\\${parsed_values', 'docopt_direct', 'shasum', 'memo']:
+    assert code not in parser
+  program = '''
+DOC="{doc}"
+{parser}
+eval "$(docopt "$@")"
+echo "${{_name_[@]}}"
+'''.format(doc=doc, parser=parser)
+  for argv in [['-n', 'ship', 'new', 'Argo'], ['ship', 'new', '--name=Argo']]:
+    code, out, err = bash_eval_script(bash, program, argv)
+    assert code == 1
+    assert err == 'Usage: echo_ship_name.sh ship new <name>...\n'
+  code, out, err = bash_eval_script(bash, program, ['ship', 'new', 'Argo', 'Kon-Tiki'])
+  assert code == 0
+  assert out == 'Argo Kon-Tiki\n'
+
+
+def test_mangled_names(monkeypatch, capsys, bash):
+  # commands and options named like the functions and variables of the parser
+  doc = 'Usage: prog parse heads [--match=<m>] [--consumed] <value>...'
+  script = '''
+DOC="{doc}"
+docopt_parse "$@" || exit "$docopt_status"
+echo "$parse $heads $__match $__consumed ${{_value_[*]}}"
+'''.format(doc=doc)
+  parser = invoke_docopt(monkeypatch, capsys=capsys, program_params=['--parser', '-'], stdin=StringIO(script)).out
+  for name in ['parsed_params', 'initial_consumed', 'node_', 'lookup_option', 'rollback']:
+    assert name not in parser
+  assert max(map(len, parser.split('\n'))) <= 80
+  program = '''
+DOC="{doc}"
+{parser}
+{script}
+'''.format(doc=doc, parser=parser, script=script.split('\n', 2)[2])
+  code, out, err = bash_eval_script(bash, program, ['parse', 'heads', 'a', '--match=b', 'c', '--cons'])
+  assert err == ''
+  assert code == 0
+  assert out == 'true true b true a c\n'
+
+
 def test_teardown(monkeypatch, capsys, bash):
   run = patch_file(monkeypatch, capsys, 'all_vars.sh')
   code, out, err = run(bash, 'ship', 'new', 'Britannica')
@@ -187,6 +459,37 @@ def test_library(monkeypatch, capsys, bash):
     assert out == 'Britannica\n'
 
 
+def test_library_loaded(monkeypatch, capsys, bash):
+  # Traces the libraries that are sourced
+  trace = 'source() { echo "source $(basename "$1")" >&2; builtin source "$@"; }'
+  with generated_library(monkeypatch, capsys) as library, NamedTemporaryFile(mode='w') as child:
+    child.write(invoke_docopt(
+      monkeypatch, capsys, program_params=['--library', library.name, '-'],
+      stdin=StringIO('DOC="Usage: child.sh <x>"\n%s\neval "$(docopt "$@")"\necho "child $_x_"\n' % trace)
+    ).out)
+    child.flush()
+    parent = invoke_docopt(monkeypatch, capsys, program_params=['--library', library.name, '-'], stdin=StringIO('''
+DOC="Usage: parent.sh <x>"
+{trace}
+DOCOPT_LIB_EXPORT=$1
+shift
+docopt_parse "$@" || exit "$docopt_status"
+echo "parent $_x_"
+docopt_parse again || exit "$docopt_status"
+echo "parent $_x_"
+bash {child} kid
+'''.format(trace=trace, child=child.name))).out
+    name = os.path.basename(library.name)
+    code, out, err = bash_eval_script(bash, parent, ['true', 'first'])
+    assert err == 'source %s\n' % name
+    assert code == 0
+    assert out == 'parent first\nparent again\nchild kid\n'
+    code, out, err = bash_eval_script(bash, parent, ['false', 'first'])
+    assert err == 'source %s\nsource %s\n' % (name, name)
+    assert code == 0
+    assert out == 'parent first\nparent again\nchild kid\n'
+
+
 def test_library_missing(monkeypatch, capsys, bash):
   run = patch_file(
     monkeypatch, capsys, 'echo_ship_name.sh',
@@ -216,6 +519,43 @@ def test_library_teardown(monkeypatch, capsys, bash):
         assert not name.lower().startswith('docopt') or name in allowed_fns
 
 
+@pytest.mark.parametrize('program_params', [[], ['--line-length', '0', '--define-once']])
+def test_parse_function(monkeypatch, capsys, bash, program_params):
+  run = patch_file(monkeypatch, capsys, 'parse_function.sh', program_params=program_params)
+  code, out, err = run(bash, 'ship', 'new', 'Britannica', 'Olympia')
+  assert err == ''
+  assert code == 0
+  # the functions and variables of the script are left as they were
+  assert out == "Britannica Olympia\nThe script's error()\nscript\n"
+  code, out, err = run(bash, '--help')
+  assert err == ''
+  assert code == 0
+  assert out == 'Usage: parse_function.sh ship new <name>...\n'
+  code, out, err = run(bash, 'ship', '--bad-opt')
+  assert err == 'Usage: parse_function.sh ship new <name>...\n'
+  assert code == 1
+  assert out == ''
+
+
+def test_parse_function_library_version(monkeypatch, capsys, bash):
+  with generated_library(monkeypatch, capsys) as library:
+    with temp_file('parse_function.sh') as (script, run):
+      invoke_docopt(monkeypatch, program_params=['--library', library.name, script.name])
+      with open(script.name, 'r') as h:
+        contents = h.read()
+      contents = re.sub(r"source (\S+) '([^']+)'", r"source \1 '0.0.0'", contents)
+      with open(script.name, 'w') as h:
+        h.write(contents)
+      code, out, err = run(bash, 'ship', 'new', 'Olympia')
+      regex = (
+        r'^The version of the included docopt library \([^)]+\) does not '
+        r'match the version of the invoking docopt parser \(0\.0\.0\)\n$'
+      )
+      assert re.match(regex, err) is not None
+      assert code == 70
+      assert out == ''
+
+
 def test_library_version(monkeypatch, capsys, bash):
   with generated_library(monkeypatch, capsys) as library:
     with temp_file('echo_ship_name.sh') as (script, run):
@@ -286,3 +626,43 @@ Options:
   -v  Variable to test [default: $foo]
   -s  Thing to test against, like "hello" [default: hi]
 '''
+
+
+def test_posix_target(monkeypatch, capsys, posix_shell):
+  run = patch_file(monkeypatch, capsys, 'posix_ship_name.sh', program_params=['--target', 'posix'])
+  code, out, err = run(posix_shell, 'ship', 'new', "Queen Anne's Revenge", 'Olympia')
+  assert err == ''
+  assert code == 0
+  assert out == "2 ships: Queen Anne's Revenge Olympia\n"
+  code, out, err = run(posix_shell, '--help')
+  assert err == ''
+  assert code == 0
+  assert out == 'Usage: posix_ship_name.sh ship new <name>...\n'
+  code, out, err = run(posix_shell, 'ship', '--bad-opt')
+  assert err == 'Usage: posix_ship_name.sh ship new <name>...\n'
+  assert code == 1
+  assert out == ''
+
+
+def test_posix_target_doc_check(monkeypatch, posix_shell):
+  with temp_file('posix_ship_name.sh') as (script, run):
+    invoke_docopt(monkeypatch, program_params=['--target', 'posix', script.name])
+    with open(script.name, 'r') as h:
+      contents = h.read()
+    contents = contents.replace('ship new <name>', 'ship wen <name>', 1)
+    with open(script.name, 'w') as h:
+      h.write(contents)
+    code, out, err = run(posix_shell, 'ship', 'wen', 'Olympia')
+    assert err == (
+      'The current usage doc does not match what the parser was generated with\n'
+      'Run `docopt.sh` to refresh the parser.\n'
+    )
+    assert code == 70
+
+
+def test_posix_target_unsupported(monkeypatch, capsys):
+  for params, name in [(['--codegen', 'inline'], 'echo_ship_name.sh'), ([], 'parse_function.sh')]:
+    with open(os.path.join('tests/scripts', name)) as handle:
+      with pytest.raises(SystemExit):
+        invoke_docopt(monkeypatch, program_params=['--target', 'posix', '-'] + params, stdin=StringIO(handle.read()))
+    assert capsys.readouterr().out == ''
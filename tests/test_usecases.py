@@ -9,7 +9,23 @@ def test_usecase(monkeypatch, capsys, usecase, bash):
   assert convert_to_bash(bash, usecase) == run_usecase(monkeypatch, capsys, usecase, bash)
 
 
-def run_usecase(monkeypatch, capsys, usecase, bash):
+def test_usecase_helpers(monkeypatch, capsys, usecase, bash):
+  assert convert_to_bash(bash, usecase) == run_usecase(monkeypatch, capsys, usecase, bash, ['--codegen', 'helpers'])
+
+
+def test_usecase_inline(monkeypatch, capsys, usecase, bash):
+  assert convert_to_bash(bash, usecase) == run_usecase(monkeypatch, capsys, usecase, bash, ['--codegen', 'inline'])
+
+
+def test_usecase_lazy(monkeypatch, capsys, usecase, bash):
+  assert convert_to_bash(bash, usecase) == run_usecase(monkeypatch, capsys, usecase, bash, ['--codegen', 'lazy'])
+
+
+def test_usecase_posix(monkeypatch, capsys, usecase, posix_shell):
+  assert convert_to_posix(posix_shell, usecase) == run_usecase_posix(monkeypatch, capsys, usecase, posix_shell)
+
+
+def run_usecase(monkeypatch, capsys, usecase, bash, program_params=[]):
   lineno, _, doc, prog, argv, expect = usecase
   program_template = '''
 DOC="{doc}"
@@ -23,6 +39,7 @@ fi
   run = patch_stream(
     monkeypatch, capsys,
     io.StringIO(program),
+    program_params=program_params,
     docopt_params={'DOCOPT_PREFIX': '_usecase_'}
   )
   code, out, err = run(bash, *shlex.split(argv))
@@ -40,6 +57,40 @@ fi
   return Usecase(lineno, bash[0], doc, prog, argv, result)
 
 
+def run_usecase_posix(monkeypatch, capsys, usecase, shell):
+  lineno, _, doc, prog, argv, expect = usecase
+  # `set` lists the variables, their values are printed unquoted
+  program_template = '''
+DOC="{doc}"
+"DOCOPT PARAMS"
+eval "$(docopt "$@")"
+for usecase_name in $(set | sed -n 's/^\\(_usecase_[A-Za-z0-9_]*\\)=.*/\\1/p'); do
+  eval "usecase_value=\\$$usecase_name"
+  printf '%s=%s\\n' "$usecase_name" "$usecase_value"
+done
+'''
+  program = program_template.format(doc=doc)
+  run = patch_stream(
+    monkeypatch, capsys,
+    io.StringIO(program),
+    program_params=['--target', 'posix'],
+    docopt_params={'DOCOPT_PREFIX': '_usecase_'}
+  )
+  code, out, err = run(shell, *shlex.split(argv))
+  if code == 0:
+    expr = re.compile('^(_usecase_[A-Za-z0-9_]*)=')
+    out = out.strip('\n')
+    result = {}
+    if out != '':
+      for line in out.split('\n'):
+        if expr.match(line) is None:
+          raise Exception('Unable to match %s for usecase on line %d' % (line, lineno))
+        result[expr.match(line).group(1)] = line
+  else:
+    result = 'user-error'
+  return Usecase(lineno, shell[0], doc, prog, argv, result)
+
+
 def convert_to_bash(bash, usecase):
   lineno, _, doc, prog, argv, expect = usecase
   if expect == 'user-error':
@@ -52,6 +103,29 @@ def convert_to_bash(bash, usecase):
   return Usecase(lineno, bash[0], doc, prog, argv, declarations)
 
 
+def convert_to_posix(shell, usecase):
+  lineno, _, doc, prog, argv, expect = usecase
+  if expect == 'user-error':
+    assignments = expect
+  else:
+    assignments = {}
+    for key, value in expect.items():
+      var = '_usecase_' + re.sub(r'^[^a-z_]|[^a-z0-9_]', '_', key, 0, re.IGNORECASE)
+      assignments[var] = '{name}={value}'.format(name=var, value=posix_value(value))
+  return Usecase(lineno, shell[0], doc, prog, argv, assignments)
+
+
+def posix_value(value):
+  # lists are strings of single quoted words
+  if value is None:
+    return ''
+  if type(value) is bool:
+    return 'true' if value else 'false'
+  if type(value) is list:
+    return ' '.join("'%s'" % item.replace("'", "'\\''") for item in value)
+  return str(value)
+
+
 def bash_decl(bash_version, name, value):
   if value is None or type(value) in (bool, int, str):
     return 'declare -- {name}={value}'.format(name=name, value=bash_decl_value(bash_version, value))
@@ -76,3 +150,47 @@ def bash_decl_value(bash_version, value):
     return list_tpl.format(value=' '.join('[{i}]={value}'.format(
       i=i, value=bash_decl_value(bash_version, v)) for i, v in enumerate(value))
     )
+
+
+def test_no_forks(monkeypatch, capsys, bash):
+  # Subshells are detected with an inherited DEBUG trap, external commands
+  # show up in the hash table. docopt runs in the current shell so that
+  # the substitution from `eval "$(docopt "$@")"` is not counted.
+  program = '''
+DOC="Usage: prog [-v...] [--name=<n>] <file>..."
+"DOCOPT PARAMS"
+hash -r
+set -T
+trap 'if ((BASH_SUBSHELL)); then printf "forked: %s\\n" "$BASH_COMMAND" >&2; fi' DEBUG
+docopt "$@" >/dev/null
+trap - DEBUG
+hash
+'''
+  run = patch_stream(monkeypatch, capsys, io.StringIO(program))
+  argv = ['-vv', '--name', 'docopt'] + ['file%d' % i for i in range(200)]
+  code, out, err = run(bash, *argv)
+  assert err == ''
+  assert code == 0
+  assert out == 'hash: hash table empty\n'
+
+
+def test_no_forks_output(monkeypatch, capsys, bash):
+  # The output for --help and usage errors is printed by the caller without
+  # running external commands, the hash table is printed when the eval exits
+  program = '''
+DOC="Usage: prog [-v]"
+"DOCOPT PARAMS"
+docopt_output=$(docopt "$@")
+hash -r
+trap hash EXIT
+eval "$docopt_output"
+'''
+  run = patch_stream(monkeypatch, capsys, io.StringIO(program))
+  code, out, err = run(bash, '--help')
+  assert err == ''
+  assert code == 0
+  assert out == 'Usage: prog [-v]\nhash: hash table empty\n'
+  code, out, err = run(bash, '-x')
+  assert err == 'Usage: prog [-v]\n'
+  assert code == 1
+  assert out == 'hash: hash table empty\n'